@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture(autouse=True, scope='session')
+def temporary_runtime_files(django_test_environment):
+    """Кэш и метрики тестов во временном каталоге, а не в BASE_DIR."""
+    from core.testing import temporary_runtime_files
+    with temporary_runtime_files():
+        yield
@@ -0,0 +1,355 @@
+"""Двухуровневый кэш: LRU в памяти процесса поверх общего SQLite-файла.
+
+Общий уровень (SQLiteCache) — файл, который видят все рабочие процессы.
+TwoTierCache держит перед ним небольшой LRU с TTL в памяти процесса.
+Каждая запись и удаление попадают в журнал инвалидаций в том же файле;
+процессы читают журнал не реже SYNC_INTERVAL секунд и выбрасывают у себя
+изменённые ключи, поэтому чужие записи видны не позже этого интервала.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import metrics
+
+CULL_EVERY_WRITES = 100
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    'CREATE TABLE IF NOT EXISTS invalidations ('
+    ' seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, created REAL)',
+)
+
+
+class SQLiteCache(BaseCache):
+    """Кэш в SQLite-файле, общий для всех процессов одной машины."""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        # После fork соединение родителя использовать нельзя.
+        pid, connection = getattr(self._local, 'connection', (None, None))
+        if pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=30,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._local.connection = (os.getpid(), connection)
+        return connection
+
+    def _expires(self, timeout):
+        return self.get_backend_timeout(timeout)
+
+    def _log(self, connection, key):
+        cursor = connection.execute(
+            'INSERT INTO invalidations (key, created) VALUES (?, ?)',
+            (key, time.time()))
+        return cursor.lastrowid
+
+    def _read(self, key):
+        """Возвращает (pickle-данные, expires) или None."""
+        return self._connection().execute(
+            'SELECT value, expires FROM cache WHERE key = ?'
+            ' AND (expires IS NULL OR expires > ?)',
+            (key, time.time())).fetchone()
+
+    def _write(self, key, value, timeout, only_new=False):
+        expires = self._expires(timeout)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            if only_new:
+                exists = connection.execute(
+                    'SELECT 1 FROM cache WHERE key = ?'
+                    ' AND (expires IS NULL OR expires > ?)',
+                    (key, time.time())).fetchone()
+                if exists:
+                    return None
+            connection.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires)'
+                ' VALUES (?, ?, ?)', (key, data, expires))
+            seq = self._log(connection, key)
+        self._maybe_cull()
+        return data, expires, seq
+
+    def _maybe_cull(self):
+        self._writes += 1
+        if self._writes % CULL_EVERY_WRITES:
+            return
+        connection = self._connection()
+        (total,) = connection.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if total <= self._max_entries:
+            return
+        with connection:
+            connection.execute('DELETE FROM cache WHERE expires <= ?',
+                               (time.time(),))
+            if self._cull_frequency:
+                connection.execute(
+                    'DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache'
+                    ' ORDER BY expires LIMIT ?)',
+                    (total // self._cull_frequency,))
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        found = self._read(key)
+        return default if found is None else pickle.loads(found[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._write(key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._write(key, value, timeout, only_new=True) is not None
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        connection = self._connection()
+        with connection:
+            cursor = connection.execute(
+                'UPDATE cache SET expires = ? WHERE key = ?'
+                ' AND (expires IS NULL OR expires > ?)',
+                (self._expires(timeout), key, time.time()))
+        return bool(cursor.rowcount)
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self._log(connection, key)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._read(key) is not None
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                'SELECT value FROM cache WHERE key = ?'
+                ' AND (expires IS NULL OR expires > ?)',
+                (key, time.time())).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            connection.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), key))
+            self._log(connection, key)
+        return value
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('DELETE FROM cache')
+            self._log(connection, None)
+
+    def close(self, **kwargs):
+        # Соединение живёт в потоке всё время работы процесса.
+        pass
+
+
+class LocalTier:
+    """LRU с TTL в памяти процесса, общий для всех потоков.
+
+    Django создаёт экземпляр бэкенда на каждый поток, поэтому сам LRU
+    хранится в реестре по (LOCATION, pid), а не в экземпляре.
+    """
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.last_seq = None
+        self.last_sync = 0.0
+        self.stats = dict.fromkeys(
+            ('local_hits', 'local_misses', 'shared_hits', 'shared_misses'), 0)
+
+    @classmethod
+    def for_location(cls, location, max_entries):
+        key = (location, os.getpid())
+        with cls._registry_lock:
+            if key not in cls._registry:
+                cls._registry[key] = cls(max_entries)
+            return cls._registry[key]
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self.entries.move_to_end(key)
+                self.stats['local_hits'] += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+            self.stats['local_misses'] += 1
+        return None
+
+    def put(self, key, data, expires, seq):
+        with self.lock:
+            self.entries[key] = (data, expires, seq)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def forget(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate(self, rows):
+        with self.lock:
+            for seq, key in rows:
+                if key is None:
+                    self.entries.clear()
+                    continue
+                entry = self.entries.get(key)
+                if entry is not None and entry[2] < seq:
+                    del self.entries[key]
+            self.last_seq = max(self.last_seq or 0, rows[-1][0])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TwoTierCache(SQLiteCache):
+    """SQLiteCache с ограниченным LRU в памяти процесса перед ним.
+
+    OPTIONS: LOCAL_MAX_ENTRIES — размер LRU, LOCAL_TIMEOUT — сколько
+    секунд запись живёт в памяти, SYNC_INTERVAL — как часто читать журнал
+    инвалидаций. Счётчики попаданий по уровням отдаёт get_stats(), а с
+    METRICS_NAME они попадают и в метрики с меткой cache.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(location, params)
+        options = params.get('OPTIONS', {})
+        self._local_timeout = float(options.get('LOCAL_TIMEOUT', 60))
+        self._sync_interval = float(options.get('SYNC_INTERVAL', 0.1))
+        self._max_local = int(options.get('LOCAL_MAX_ENTRIES', 1000))
+        self._metrics_name = options.get('METRICS_NAME')
+
+    @property
+    def _tier(self):
+        return LocalTier.for_location(self._path, self._max_local)
+
+    def _remember(self, key, data, expires, seq):
+        local_expires = time.time() + self._local_timeout
+        if expires is not None:
+            local_expires = min(local_expires, expires)
+        self._tier.put(key, data, local_expires, seq)
+
+    def _sync(self):
+        tier = self._tier
+        now = time.time()
+        if now - tier.last_sync < self._sync_interval:
+            return
+        tier.last_sync = now
+        connection = self._connection()
+        if tier.last_seq is None:
+            (tier.last_seq,) = connection.execute(
+                'SELECT IFNULL(MAX(seq), 0) FROM invalidations').fetchone()
+            return
+        rows = connection.execute(
+            'SELECT seq, key FROM invalidations WHERE seq > ? ORDER BY seq',
+            (tier.last_seq,)).fetchall()
+        if rows:
+            tier.invalidate(rows)
+            # Инвалидация старше LOCAL_TIMEOUT уже не застанет запись
+            # в памяти ни одного процесса: та истекла бы раньше.
+            with connection:
+                connection.execute(
+                    'DELETE FROM invalidations WHERE created < ?',
+                    (now - self._local_timeout - 1,))
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._sync()
+        tier = self._tier
+        data = tier.get(key)
+        if data is not None:
+            self._count('local_hit')
+            return pickle.loads(data)
+        seq = tier.last_seq or 0
+        found = self._read(key)
+        if found is None:
+            tier.stats['shared_misses'] += 1
+            self._count('miss')
+            return default
+        tier.stats['shared_hits'] += 1
+        self._count('shared_hit')
+        self._remember(key, found[0], found[1], seq)
+        return pickle.loads(found[0])
+
+    def _count(self, result):
+        if self._metrics_name:
+            metrics.inc('yatube_cache_requests_total',
+                        cache=self._metrics_name, result=result)
+
+    def has_key(self, key, version=None):
+        return self.get(key, self, version=version) is not self
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._remember(key, *self._write(key, value, timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        written = self._write(key, value, timeout, only_new=True)
+        if written is None:
+            return False
+        self._remember(key, *written)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._tier.forget(self.make_key(key, version=version))
+        return super().touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._tier.forget(self.make_key(key, version=version))
+        super().delete(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._tier.forget(self.make_key(key, version=version))
+        return super().incr(key, delta, version=version)
+
+    def clear(self):
+        self._tier.clear()
+        super().clear()
+
+    def get_stats(self):
+        tier = self._tier
+        stats = dict(tier.stats)
+        stats['local_entries'] = len(tier.entries)
+        return stats
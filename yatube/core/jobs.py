@@ -0,0 +1,135 @@
+"""Очередь фоновых задач в основной базе.
+
+defer() сохраняет вызов функции уровня модуля строкой Job в той же
+транзакции, что и запрос, поэтому задача не потеряется и не увидит
+неподтверждённых данных. manage.py worker забирает задачи claim():
+условный UPDATE ставит каждой строке метку именно этого захвата, и
+два воркера не получат одну задачу (в PostgreSQL выборка к тому же
+идёт с SKIP LOCKED). Упавшая задача повторяется с экспоненциальной
+паузой, после JOBS_MAX_ATTEMPTS попыток остаётся со статусом dead.
+Выполненные задачи удаляются.
+
+Без воркера (JOBS_ALWAYS_EAGER, по умолчанию при DEBUG) готовые задачи
+выполняет сам процесс после подтверждения транзакции, поставившей
+задачу: письма и миниатюры не застревают в очереди при одном runserver.
+"""
+import json
+import logging
+import random
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .models import Job
+from .sqlite.base import LOCK_RETRIES, LOCK_RETRY_DELAY, is_locked
+
+logger = logging.getLogger(__name__)
+
+
+def defer(func, *args, delay=0, max_attempts=None, **kwargs):
+    """Ставит func(*args, **kwargs) в очередь. Аргументы — JSON."""
+    name = f'{func.__module__}.{func.__qualname__}'
+    if '<' in name:
+        raise ValueError(f'{name}: нужна функция уровня модуля')
+    job = Job.objects.create(
+        name=name,
+        payload=json.dumps({'args': args, 'kwargs': kwargs}),
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    if settings.JOBS_ALWAYS_EAGER:
+        transaction.on_commit(run_pending)
+    return job
+
+
+def _claimable(now):
+    # Задача, чей воркер умер, не держится вечно: её можно взять снова.
+    stale = now - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT)
+    return (Q(status=Job.PENDING, run_at__lte=now)
+            | Q(status=Job.RUNNING, locked_at__lt=stale))
+
+
+def retry_locked(func, *args, **kwargs):
+    """Повторяет транзакцию func, упавшую на блокировке базы."""
+    for attempt in range(LOCK_RETRIES + 1):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as exc:
+            if attempt == LOCK_RETRIES or not is_locked(exc):
+                raise
+        time.sleep(LOCK_RETRY_DELAY * 2 ** attempt * random.random())
+
+
+def claim(worker, limit):
+    """Забирает до limit готовых задач для worker."""
+    return retry_locked(_claim, worker, limit)
+
+
+def _claim(worker, limit):
+    now = timezone.now()
+    token = f'{worker}:{uuid.uuid4().hex}'
+    with transaction.atomic():
+        ids = list(
+            Job.objects.filter(_claimable(now))
+            .select_for_update(
+                skip_locked=connection.features
+                .has_select_for_update_skip_locked)
+            .order_by('run_at').values_list('pk', flat=True)[:limit])
+        Job.objects.filter(_claimable(now), pk__in=ids).update(
+            status=Job.RUNNING, locked_by=token, locked_at=now,
+            attempts=F('attempts') + 1)
+    return list(Job.objects.filter(locked_by=token).order_by('run_at'))
+
+
+def backoff(attempts):
+    """Пауза перед следующей попыткой, с разбросом."""
+    return settings.JOBS_BACKOFF * 2 ** (attempts - 1) * (
+        0.5 + random.random())
+
+
+def run(job):
+    """Выполняет взятую задачу и записывает результат."""
+    mine = Job.objects.filter(pk=job.pk, locked_by=job.locked_by)
+    try:
+        payload = json.loads(job.payload)
+        with metrics.timer('yatube_job_seconds', job=job.name):
+            import_string(job.name)(*payload['args'], **payload['kwargs'])
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error('Задача %s не выполнена после %s попыток:\n%s',
+                         job, job.attempts, error)
+            retry_locked(mine.update, status=Job.DEAD, last_error=error,
+                         locked_by='')
+            metrics.inc('yatube_jobs_total', job=job.name, result='dead')
+            return False
+        logger.warning('Задача %s упала, попытка %s:\n%s',
+                       job, job.attempts, error)
+        retry_locked(mine.update, status=Job.PENDING, last_error=error,
+                     locked_by='', run_at=timezone.now() + timedelta(
+                         seconds=backoff(job.attempts)))
+        metrics.inc('yatube_jobs_total', job=job.name, result='retry')
+        return False
+    retry_locked(mine.delete)
+    metrics.inc('yatube_jobs_total', job=job.name, result='done')
+    return True
+
+
+def run_pending(worker='inline', batch=100):
+    """Выполняет все готовые задачи в текущем потоке; их число."""
+    done = 0
+    while True:
+        jobs = claim(worker, batch)
+        if not jobs:
+            return done
+        for job in jobs:
+            run(job)
+            done += 1
@@ -0,0 +1,41 @@
+"""Отправка писем фоновой задачей.
+
+QueuedEmailBackend только ставит письмо в очередь core.jobs, а
+отправляет его воркер через QUEUED_EMAIL_BACKEND, поэтому медленный
+SMTP не задерживает ответ (например, PasswordResetView). Вложения не
+поддерживаются: их в проекте не отправляют.
+"""
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+from . import jobs
+
+# Аргумент EmailMultiAlternatives: атрибут письма.
+FIELDS = {
+    'subject': 'subject',
+    'body': 'body',
+    'from_email': 'from_email',
+    'to': 'to',
+    'cc': 'cc',
+    'bcc': 'bcc',
+    'reply_to': 'reply_to',
+    'headers': 'extra_headers',
+    'alternatives': 'alternatives',
+}
+
+
+def send_email(message):
+    """Задача: отправляет письмо, сохранённое QueuedEmailBackend."""
+    with get_connection(settings.QUEUED_EMAIL_BACKEND) as connection:
+        EmailMultiAlternatives(connection=connection, **message).send()
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        for message in email_messages:
+            jobs.defer(send_email, {
+                argument: getattr(message, attribute, None)
+                for argument, attribute in FIELDS.items()
+            })
+        return len(email_messages)
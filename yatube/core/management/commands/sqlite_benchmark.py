@@ -0,0 +1,176 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+SCHEMA = (
+    'CREATE TABLE posts (id INTEGER PRIMARY KEY, author_id INTEGER,'
+    ' text TEXT, pub_date REAL)',
+    'CREATE INDEX posts_author_pub_date ON posts (author_id, pub_date)',
+    'CREATE TABLE counters (author_id INTEGER PRIMARY KEY, posts INTEGER)',
+)
+AUTHORS = 100
+ALIAS = 'sqlite_benchmark'
+
+
+def percentile(values, rank):
+    """Перцентиль по ближайшему рангу, 0 для пустого списка."""
+    values = sorted(values)
+    return values[max(0, -(-len(values) * rank // 100) - 1)] if values else 0
+
+
+@contextmanager
+def benchmark_database(path, tuned):
+    """Временный псевдоним в django.db.connections для файла path.
+
+    Боевой режим — ENGINE и OPTIONS основной базы (core.sqlite с его
+    PRAGMA, BEGIN IMMEDIATE и повтором при блокировке), режим по
+    умолчанию — стандартный бэкенд Django.
+    """
+    default = settings.DATABASES['default']
+    connections.databases[ALIAS] = {
+        'ENGINE': (default['ENGINE'] if tuned
+                   else 'django.db.backends.sqlite3'),
+        'NAME': path,
+        'OPTIONS': default.get('OPTIONS', {}) if tuned else {},
+    }
+    try:
+        yield
+    finally:
+        connections[ALIAS].close()
+        del connections[ALIAS]
+        del connections.databases[ALIAS]
+
+
+class Mode:
+    """Как рабочий поток пользуется соединением и пишет."""
+
+    def __init__(self, tuned):
+        self.tuned = tuned
+
+    def release(self):
+        # Боевой режим держит соединение потока, как CONN_MAX_AGE.
+        if not self.tuned:
+            connections[ALIAS].close()
+
+    def read(self):
+        try:
+            with connections[ALIAS].cursor() as cursor:
+                cursor.execute(
+                    'SELECT id, text FROM posts WHERE author_id = %s'
+                    ' ORDER BY pub_date DESC LIMIT 10',
+                    (random.randrange(AUTHORS),))
+                cursor.fetchall()
+        finally:
+            self.release()
+
+    def write(self):
+        # Как post_create: запись поста и счётчика в одной транзакции.
+        author_id = random.randrange(AUTHORS)
+        try:
+            with transaction.atomic(using=ALIAS), \
+                    connections[ALIAS].cursor() as cursor:
+                cursor.execute(
+                    'SELECT posts FROM counters WHERE author_id = %s',
+                    (author_id,))
+                cursor.fetchone()
+                cursor.execute(
+                    'INSERT INTO posts (author_id, text, pub_date)'
+                    ' VALUES (%s, %s, %s)',
+                    (author_id, 'x' * 200, time.time()))
+                cursor.execute(
+                    'UPDATE counters SET posts = posts + 1'
+                    ' WHERE author_id = %s', (author_id,))
+        finally:
+            self.release()
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает SQLite с настройками по умолчанию и боевой режим '
+            'core.sqlite (WAL, PRAGMA, BEGIN IMMEDIATE, постоянные '
+            'соединения) под одновременными чтениями и записями.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8,
+                            help='Потоков, читающих ленту автора.')
+        parser.add_argument('--writers', type=int, default=2,
+                            help='Потоков, публикующих посты.')
+        parser.add_argument('--seconds', type=float, default=3,
+                            help='Сколько длится каждый прогон.')
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='Постов в базе перед прогоном.')
+
+    def handle(self, *args, **options):
+        self.stdout.write('mode     reads/s  writes/s  read_p95_ms  '
+                          'write_p95_ms  errors')
+        for tuned in (False, True):
+            with tempfile.TemporaryDirectory() as directory, \
+                    benchmark_database(
+                        os.path.join(directory, 'bench.sqlite3'), tuned):
+                self.seed(options['rows'])
+                result = self.run(Mode(tuned), options)
+            self.stdout.write(
+                f'{"tuned" if tuned else "default":<8} '
+                f'{result["reads"] / options["seconds"]:>7.0f}  '
+                f'{result["writes"] / options["seconds"]:>8.0f}  '
+                f'{percentile(result["read_ms"], 95):>11.2f}  '
+                f'{percentile(result["write_ms"], 95):>12.2f}  '
+                f'{result["errors"]:>6}')
+
+    def seed(self, rows):
+        with transaction.atomic(using=ALIAS), \
+                connections[ALIAS].cursor() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+            cursor.executemany(
+                'INSERT INTO posts (author_id, text, pub_date)'
+                ' VALUES (%s, %s, %s)',
+                [(number % AUTHORS, 'x' * 200, number)
+                 for number in range(rows)])
+            cursor.executemany(
+                'INSERT INTO counters VALUES (%s, 0)',
+                [(author_id,) for author_id in range(AUTHORS)])
+
+    def run(self, mode, options):
+        result = {'reads': 0, 'writes': 0, 'errors': 0,
+                  'read_ms': [], 'write_ms': []}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['seconds']
+
+        def worker(operation, kind):
+            done, timings, errors = 0, [], 0
+            try:
+                while time.monotonic() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        operation()
+                    except OperationalError:
+                        errors += 1
+                        continue
+                    timings.append((time.perf_counter() - started) * 1000)
+                    done += 1
+            finally:
+                # Соединения потоковые: закрыть может только сам поток.
+                connections[ALIAS].close()
+            with lock:
+                result[kind] += done
+                result[f'{kind[:-1]}_ms'].extend(timings)
+                result['errors'] += errors
+
+        threads = (
+            [threading.Thread(target=worker, args=(mode.read, 'reads'))
+             for _ in range(options['readers'])]
+            + [threading.Thread(target=worker, args=(mode.write, 'writes'))
+               for _ in range(options['writers'])]
+        )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return result
@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.replica import sync_replica
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу в реплику REPLICA_DATABASE. С --loop '
+            'повторяет копирование каждые REPLICA_SYNC_INTERVAL секунд.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Не выходить после первого копирования.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            sync_replica()
+            self.stdout.write(f'Реплика обновлена за '
+                              f'{time.monotonic() - started:.2f} с')
+            if not options['loop']:
+                return
+            time.sleep(settings.REPLICA_SYNC_INTERVAL)
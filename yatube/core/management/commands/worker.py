@@ -0,0 +1,77 @@
+import logging
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import jobs, metrics
+
+logger = logging.getLogger('core.jobs')
+
+
+def run_in_thread(job):
+    # У каждого потока пула своё соединение с БД и свой буфер метрик.
+    close_old_connections()
+    try:
+        return jobs.run(job)
+    except Exception:
+        # Не удалось записать результат: задача останется running и
+        # после JOBS_LOCK_TIMEOUT выполнится снова.
+        logger.exception('Задача %s: ошибка базы очереди', job)
+        return False
+    finally:
+        close_old_connections()
+        metrics.flush()
+
+
+class Command(BaseCommand):
+    help = ('Выполняет фоновые задачи из очереди core.jobs в пуле потоков. '
+            'SIGTERM и SIGINT дают дождаться уже взятых задач.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int,
+                            default=settings.JOBS_WORKERS,
+                            help='Сколько задач выполнять одновременно.')
+        parser.add_argument('--once', action='store_true',
+                            help='Выйти, когда готовых задач не останется.')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        stop = threading.Event()
+        handlers = {signum: signal.signal(signum, lambda *args: stop.set())
+                    for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            done = self.work(worker, threads, stop, options['once'])
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        metrics.flush()
+        self.stdout.write(f'Выполнено задач: {done}')
+
+    def work(self, worker, threads, stop, once):
+        done = 0
+        running = set()
+        with ThreadPoolExecutor(threads,
+                                thread_name_prefix='jobs') as executor:
+            while not stop.is_set():
+                if len(running) < threads:
+                    running.update(
+                        executor.submit(run_in_thread, job)
+                        for job in jobs.claim(worker, threads - len(running)))
+                if not running:
+                    if once:
+                        break
+                    stop.wait(settings.JOBS_POLL_INTERVAL)
+                    continue
+                finished, running = wait(
+                    running, timeout=settings.JOBS_POLL_INTERVAL,
+                    return_when=FIRST_COMPLETED)
+                done += len(finished)
+            done += len(wait(running).done)
+        return done
@@ -0,0 +1,212 @@
+"""Метрики в текстовом формате Prometheus, общие для всех процессов.
+
+Горячий путь без общих блокировок: каждый поток копит приращения в
+своём буфере под своим замком и не чаще раза в METRICS_FLUSH_INTERVAL
+секунд (в inc() и по окончании запроса) сбрасывает их одной транзакцией
+в SQLite-файл METRICS_PATH (UPSERT value = value + ?). Замок потока
+перехватывает только страница /metrics/: перед чтением файла она
+сбрасывает буферы всех потоков своего процесса, в том числе простаивающих.
+Файл общий, поэтому страница видит сумму по всем рабочим процессам.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS = {
+    'yatube_http_requests_total': (
+        'counter', 'Ответы по view и коду статуса.'),
+    'yatube_http_request_duration_seconds': (
+        'histogram', 'Время ответа по view.'),
+    'yatube_template_render_seconds': (
+        'histogram', 'Время рендеринга шаблона страницы.'),
+    'yatube_db_queries_total': (
+        'counter', 'SQL-запросы по view.'),
+    'yatube_db_seconds_total': (
+        'counter', 'Время SQL-запросов по view.'),
+    'yatube_sql_budget_exceeded_total': (
+        'counter', 'Ответы сверх бюджетов SQL_* по view.'),
+    'yatube_cache_requests_total': (
+        'counter', 'Чтения кэша: попадания и промахи.'),
+    'yatube_thumbnail_seconds': (
+        'histogram', 'Время создания миниатюры или варианта картинки.'),
+    'yatube_jobs_total': (
+        'counter', 'Фоновые задачи по функции и результату.'),
+    'yatube_job_seconds': (
+        'histogram', 'Время выполнения фоновой задачи.'),
+}
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS metrics (name TEXT NOT NULL,'
+    ' labels TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (name, labels))'
+)
+
+_local = threading.local()
+# Буферы потоков процесса, чтобы render() сбросил и чужие.
+_buffers = {}
+_buffers_lock = threading.Lock()
+_buffers_pid = None
+
+
+class _Buffer:
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+        self.flushed = time.monotonic()
+
+    def take(self):
+        with self.lock:
+            values, self.values = self.values, {}
+            self.flushed = time.monotonic()
+        return values
+
+    def merge(self, values):
+        with self.lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+
+def _register(buffer):
+    global _buffers_pid
+    thread = threading.current_thread()
+    with _buffers_lock:
+        if _buffers_pid != os.getpid():
+            _buffers_pid = os.getpid()
+            _buffers.clear()
+        # Несброшенное завершившимися потоками (и прежним буфером этого
+        # потока) переходит в новый буфер, а реестр не растёт.
+        for owner, old in list(_buffers.items()):
+            if owner is thread or not owner.is_alive():
+                buffer.merge(old.take())
+                del _buffers[owner]
+        _buffers[thread] = buffer
+    return buffer
+
+
+def _buffer():
+    # После fork приращения родителя уже сброшены или принадлежат ему.
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connection = None
+        _local.buffer = _register(_Buffer())
+    return _local.buffer
+
+
+def _labels(labels):
+    return ','.join(f'{name}="{value}"'
+                    for name, value in sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    buffer = _buffer()
+    key = (name, _labels(labels))
+    with buffer.lock:
+        buffer.values[key] = buffer.values.get(key, 0) + value
+    flush_if_due()
+
+
+def observe(name, seconds, **labels):
+    """Добавляет наблюдение в гистограмму name."""
+    for bucket in BUCKETS:
+        if seconds <= bucket:
+            inc(f'{name}_bucket', le=bucket, **labels)
+    inc(f'{name}_bucket', le='+Inf', **labels)
+    inc(f'{name}_sum', seconds, **labels)
+    inc(f'{name}_count', **labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def _connection():
+    if _local.connection is None:
+        connection = sqlite3.connect(settings.METRICS_PATH, timeout=30,
+                                     isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(SCHEMA)
+        _local.connection = connection
+    return _local.connection
+
+
+def flush():
+    """Сбрасывает приращения текущего потока в общий файл."""
+    _write(_buffer().take())
+
+
+def flush_if_due():
+    """flush(), если с прошлого сброса прошло METRICS_FLUSH_INTERVAL."""
+    if (time.monotonic() - _buffer().flushed
+            >= settings.METRICS_FLUSH_INTERVAL):
+        flush()
+
+
+def flush_all():
+    """Сбрасывает приращения всех потоков процесса одной транзакцией."""
+    _buffer()
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+    values = {}
+    for buffer in buffers:
+        for key, value in buffer.take().items():
+            values[key] = values.get(key, 0) + value
+    _write(values)
+
+
+def _write(values):
+    if not values:
+        return
+    connection = _connection()
+    with connection:
+        connection.execute('BEGIN IMMEDIATE')
+        connection.executemany(
+            'INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?)'
+            ' ON CONFLICT (name, labels) DO UPDATE'
+            ' SET value = value + excluded.value',
+            [(name, labels, value)
+             for (name, labels), value in values.items()])
+
+
+def _family(name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+
+def _bucket_order(labels):
+    # Корзины гистограммы идут по возрастанию le, +Inf последней.
+    for label in labels.split(','):
+        if label.startswith('le='):
+            value = label[4:-1]
+            return (labels.replace(label, ''),
+                    float('inf') if value == '+Inf' else float(value))
+    return labels, 0
+
+
+def render():
+    """Все метрики всех процессов в текстовом формате Prometheus."""
+    flush_all()
+    rows = _connection().execute(
+        'SELECT name, labels, value FROM metrics').fetchall()
+    rows.sort(key=lambda row: (_family(row[0]), row[0],
+                               _bucket_order(row[1])))
+    lines, family = [], None
+    for name, labels, value in rows:
+        if _family(name) != family:
+            family = _family(name)
+            kind, help_text = METRICS.get(family, ('untyped', ''))
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} {kind}')
+        value = int(value) if value == int(value) else value
+        lines.append(f'{name}{{{labels}}} {value}' if labels
+                     else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
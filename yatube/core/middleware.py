@@ -0,0 +1,88 @@
+import logging
+import time
+
+from django.conf import settings
+
+from . import metrics, replica
+from .queries import record_queries
+
+logger = logging.getLogger('core.sql')
+
+
+def budget_problems(view_name, recorder):
+    """Нарушения бюджетов SQL_* из настроек, по строке на каждое."""
+    budget = settings.SQL_VIEW_BUDGETS.get(view_name,
+                                           settings.SQL_QUERY_BUDGET)
+    problems = []
+    if recorder.count > budget:
+        problems.append(f'{recorder.count} запросов при бюджете {budget}')
+    if recorder.duration_ms > settings.SQL_TIME_BUDGET_MS:
+        problems.append(f'{recorder.duration_ms:.1f} мс в базе при бюджете '
+                        f'{settings.SQL_TIME_BUDGET_MS} мс')
+    for shape, count in recorder.repeated(
+            settings.SQL_REPEAT_THRESHOLD).items():
+        problems.append(f'возможен N+1, {count} раз: {shape}')
+    return problems
+
+
+class QueryInstrumentationMiddleware:
+    """Считает SQL каждого запроса и предупреждает о превышении бюджета.
+
+    Число запросов и время в базе по view копятся в core.metrics.
+
+    Запросы, которые выполняет уже отданный потоковый ответ, не
+    учитываются.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        problems = budget_problems(view_name, recorder)
+        for problem in problems:
+            logger.warning('%s %s: %s', request.method,
+                           view_name or request.path, problem)
+        view = view_name or 'unresolved'
+        metrics.inc('yatube_db_queries_total', recorder.count, view=view)
+        metrics.inc('yatube_db_seconds_total', recorder.duration, view=view)
+        if problems:
+            metrics.inc('yatube_sql_budget_exceeded_total', view=view)
+        return response
+
+
+class MetricsMiddleware:
+    """Гистограмма времени ответа и счётчик статусов по имени view."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        metrics.observe('yatube_http_request_duration_seconds',
+                        time.perf_counter() - started, view=view)
+        metrics.inc('yatube_http_requests_total', view=view,
+                    status=response.status_code)
+        return response
+
+
+class ReplicaMiddleware:
+    """Направляет чтения страниц из REPLICA_VIEWS на реплику."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replica.start_request()
+        response = self.get_response(request)
+        replica.finish_request(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replica.route_request(request)
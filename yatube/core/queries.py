@@ -0,0 +1,54 @@
+"""Учёт SQL-запросов: число, время в базе и повторы запросов одной формы.
+
+Запросы перехватываются через connection.execute_wrapper, поэтому учёт
+работает и без DEBUG. Много запросов одной формы за один HTTP-запрос —
+типичный N+1: связанный объект подгружается лениво в цикле шаблона.
+"""
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def query_shape(sql):
+    """Форма запроса: параметры уже вынесены, схлопываются списки IN."""
+    return IN_LIST.sub('IN (...)', sql)
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    @property
+    def duration_ms(self):
+        return self.duration * 1000
+
+    def repeated(self, threshold):
+        return {shape: count for shape, count in self.shapes.items()
+                if count >= threshold}
+
+
+@contextmanager
+def record_queries():
+    """Считает запросы ко всем базам внутри блока."""
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
+
@@ -0,0 +1,109 @@
+"""Чтение с реплики, запись в основную базу.
+
+ReplicaMiddleware отмечает запросы к представлениям из REPLICA_VIEWS, и
+ReplicaRouter отправляет их чтения в REPLICA_DATABASE. Всё остальное,
+в том числе любая запись, идёт в основную базу. После записи в
+представлении из REPLICA_PIN_VIEWS браузер получает cookie на
+REPLICA_PIN_SECONDS, и пока она жива, его чтения тоже идут в основную
+базу: автор сразу видит свой пост, хотя реплика получит его только при
+следующем sync_replica.
+
+Кэш, заполненный по данным реплики, отстаёт вместе с ней: такие
+запросы добавляют к ключам и валидаторам время последнего sync_replica
+(synced_at), и после копирования старые записи перестают читаться.
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+PIN_COOKIE = 'use_primary'
+SYNCED_KEY = 'replica:synced'
+PRIMARY_APPS = {'auth', 'sessions'}
+
+_state = threading.local()
+
+
+def replica_alias():
+    """Псевдоним реплики или None, если читать с неё нельзя.
+
+    Пока sync_replica не создал файл реплики (и в тестах, где она
+    зеркало основной базы в памяти), чтения остаются в основной базе.
+    """
+    alias = settings.REPLICA_DATABASE
+    if alias not in connections.databases:
+        return None
+    if not os.path.exists(connections[alias].settings_dict['NAME']):
+        return None
+    return alias
+
+
+def reads_from_replica():
+    """Идут ли чтения текущего запроса на реплику."""
+    return (getattr(_state, 'replica', None) is not None
+            and not getattr(_state, 'wrote', False))
+
+
+def synced_at():
+    """Время последнего sync_replica или None, если оно вытеснено."""
+    return cache.get(SYNCED_KEY)
+
+
+def is_pinned(request):
+    return PIN_COOKIE in request.COOKIES
+
+
+def start_request():
+    _state.replica = None
+    _state.wrote = False
+
+
+def route_request(request):
+    view_name = request.resolver_match.view_name
+    if view_name in settings.REPLICA_VIEWS and not is_pinned(request):
+        _state.replica = replica_alias()
+
+
+def finish_request(request, response):
+    match = getattr(request, 'resolver_match', None)
+    if (_state.wrote and match
+            and match.view_name in settings.REPLICA_PIN_VIEWS):
+        response.set_cookie(PIN_COOKIE, '1',
+                            max_age=settings.REPLICA_PIN_SECONDS,
+                            httponly=True)
+    start_request()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # Сессии, пользователи (хеш пароля сверяется с сессией, новый
+        # пользователь должен сразу войти) и всё, что читается после
+        # записи в том же запросе, берутся из основной базы.
+        if getattr(_state, 'wrote', False) or \
+                model._meta.app_label in PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        return getattr(_state, 'replica', None) or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схему реплика получает вместе с данными от sync_replica.
+        return db != settings.REPLICA_DATABASE
+
+
+def sync_replica():
+    """Копирует основную базу в реплику через SQLite backup API."""
+    primary = connections[DEFAULT_DB_ALIAS]
+    replica = connections[settings.REPLICA_DATABASE]
+    primary.ensure_connection()
+    replica.ensure_connection()
+    primary.connection.backup(replica.connection)
+    cache.set(SYNCED_KEY, timezone.now(), None)
@@ -0,0 +1,10 @@
+from django.core.signals import request_finished
+from django.dispatch import receiver
+
+from . import metrics
+
+
+@receiver(request_finished)
+def flush_metrics(sender, **kwargs):
+    # Иначе приращения последнего запроса ждали бы следующего inc() потока.
+    metrics.flush_if_due()
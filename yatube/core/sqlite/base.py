@@ -0,0 +1,77 @@
+"""SQLite-бэкенд для боевого режима.
+
+Каждое новое соединение получает PRAGMA из OPTIONS['pragmas'] поверх
+PRAGMAS: WAL, чтобы читатели не ждали писателя, synchronous=NORMAL,
+mmap и больший кэш страниц. Транзакции открываются BEGIN IMMEDIATE:
+писатель берёт блокировку сразу, а не при первой записи, иначе две
+транзакции, начавшие с чтения, не могут повысить блокировку и одна
+из них сразу падает с «database is locked» в обход busy_timeout.
+Запрос вне транзакции, упавший с этой ошибкой, повторяется с паузой.
+executemany() не повторяется: в автокоммите каждая строка фиксируется
+отдельно, и повтор вставил бы уже записанные строки ещё раз.
+"""
+import random
+import time
+
+from django.db.backends.sqlite3 import base
+from django.db.backends.sqlite3.base import Database
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+LOCK_RETRIES = 5
+LOCK_RETRY_DELAY = 0.05
+
+
+def apply_pragmas(connection, pragmas):
+    for name, value in pragmas.items():
+        connection.execute(f'PRAGMA {name} = {value}')
+
+
+def is_locked(exc):
+    # «database is locked» или, при общем кэше, «database table is locked».
+    return 'is locked' in str(exc)
+
+
+class CursorWrapper(base.SQLiteCursorWrapper):
+    def _retry(self, method, *args):
+        for attempt in range(LOCK_RETRIES + 1):
+            try:
+                return method(*args)
+            except Database.OperationalError as exc:
+                # Внутри транзакции повтор одного запроса ничего не даст.
+                if (attempt == LOCK_RETRIES or not is_locked(exc)
+                        or self.connection.in_transaction):
+                    raise
+            time.sleep(LOCK_RETRY_DELAY * 2 ** attempt * random.random())
+
+    def execute(self, query, params=None):
+        return self._retry(super().execute, query, params)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = {**PRAGMAS, **params.pop('pragmas', {})}
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        apply_pragmas(connection, self.pragmas)
+        return connection
+
+    def create_cursor(self, name=None):
+        return self.connection.cursor(factory=CursorWrapper)
+
+    def _start_transaction_under_autocommit(self):
+        # В общей памяти тестовой базы блокировки потабличные, и
+        # BEGIN IMMEDIATE там конфликтует с соседними соединениями.
+        if self.is_in_memory_db():
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute('BEGIN IMMEDIATE')
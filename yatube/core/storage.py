@@ -0,0 +1,80 @@
+"""Хранилище файлов, адресуемое содержимым.
+
+Имя файла — SHA-256 его содержимого с исходным расширением, поэтому
+одинаковые загрузки лежат на диске один раз, а производные от имени
+файлы (миниатюры sorl, варианты картинок) создаются тоже один раз.
+Счётчиком ссылок служат сами строки в базе: файл удаляют, только когда
+на его имя не ссылается ни одна запись (posts.thumbnails.release_image).
+
+Строка, ссылающаяся на только что сохранённый файл, появляется в базе
+позже save() — после подтверждения транзакции. Поэтому save() под
+блокировкой имени (name_lock) берёт аренду на STORAGE_LEASE_TIMEOUT
+секунд, а удаление под той же блокировкой не трогает арендованный файл:
+иначе удаление поста с той же картинкой могло бы стереть файл, который
+вот-вот понадобится новой записи.
+"""
+import hashlib
+import posixpath
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CHUNK_SIZE = 64 * 1024
+LOCK_POLL_INTERVAL = 0.05
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks(CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _key(prefix, name):
+    return f'{prefix}:{hashlib.md5(name.encode()).hexdigest()}'
+
+
+@contextmanager
+def name_lock(name):
+    """Блокировка имени файла в кэше, общая для процессов.
+
+    Ждёт, пока её отпустят; брошенная блокировка истекает через
+    STORAGE_LOCK_TIMEOUT секунд.
+    """
+    key = _key('storage-lock', name)
+    while not cache.add(key, True, settings.STORAGE_LOCK_TIMEOUT):
+        time.sleep(LOCK_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+def is_leased(name):
+    """Сохранялся ли файл name недавно: ссылка на него может быть ещё
+    не подтверждена."""
+    return cache.get(_key('storage-lease', name)) is not None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        directory, basename = posixpath.split(name)
+        extension = posixpath.splitext(basename)[1].lower()
+        name = posixpath.join(directory, content_hash(content) + extension)
+        with name_lock(name):
+            cache.set(_key('storage-lease', name), True,
+                      settings.STORAGE_LEASE_TIMEOUT)
+            if self.exists(name):
+                # Такой же файл уже загружен: второй раз не пишем.
+                return name
+            return self._save(name, content)
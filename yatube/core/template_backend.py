@@ -0,0 +1,29 @@
+from django.template.backends import django
+
+from . import metrics
+
+
+class Template:
+    """Шаблон бэкенда Django, замеряющий время рендеринга."""
+
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        with metrics.timer('yatube_template_render_seconds',
+                           template=self._template.origin.template_name):
+            return self._template.render(context, request)
+
+
+class DjangoTemplates(django.DjangoTemplates):
+    """DjangoTemplates с метрикой времени рендеринга страниц.
+
+    Замеряются шаблоны, которые рендерит view; {% include %} входит в
+    время родительского шаблона.
+    """
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name))
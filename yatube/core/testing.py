@@ -0,0 +1,59 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from .queries import record_queries
+
+
+@contextmanager
+def temporary_runtime_files():
+    """Файлы кэша и метрик во временном каталоге, а не в BASE_DIR."""
+    with tempfile.TemporaryDirectory() as directory:
+        location = os.path.join(directory, 'cache.sqlite3')
+        caches = {alias: {**config, 'LOCATION': location}
+                  for alias, config in settings.CACHES.items()}
+        with override_settings(
+                CACHES=caches,
+                METRICS_PATH=os.path.join(directory, 'metrics.sqlite3')):
+            yield directory
+
+
+class TestRunner(DiscoverRunner):
+    """manage.py test без записи в рабочие cache.sqlite3 и
+    metrics.sqlite3: cache.clear() в тестах стирал бы настоящий кэш."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.runtime_files = temporary_runtime_files()
+        self.runtime_files.__enter__()
+
+    def teardown_test_environment(self, **kwargs):
+        self.runtime_files.__exit__(None, None, None)
+        super().teardown_test_environment(**kwargs)
+
+
+class QueryBudgetMixin:
+    """Проверка бюджета SQL-запросов страницы для TestCase."""
+
+    def assertQueryBudget(self, url, queries, data=None, client=None,
+                          repeats=None):
+        """GET url укладывается в queries запросов и без N+1."""
+        client = client or self.client
+        repeats = repeats or settings.SQL_REPEAT_THRESHOLD
+        with record_queries() as recorder:
+            response = client.get(url, data)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        problems = []
+        if recorder.count > queries:
+            problems.append(f'{recorder.count} запросов при бюджете '
+                            f'{queries}')
+        problems.extend(f'{count} раз: {shape}' for shape, count
+                        in recorder.repeated(repeats).items())
+        if problems:
+            self.fail(f'{url}: ' + '\n'.join(problems))
+        return response
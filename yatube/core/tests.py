@@ -0,0 +1,443 @@
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.signals import request_finished
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase)
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.models import Post
+
+from .cache import LocalTier, SQLiteCache, TwoTierCache
+from . import jobs, metrics
+from .middleware import QueryInstrumentationMiddleware
+from .models import Job
+from .replica import PIN_COOKIE, sync_replica
+from .sqlite import base as sqlite_base
+
+User = get_user_model()
+CALLS = []
+
+
+def record_call(*args, **kwargs):
+    CALLS.append((args, kwargs))
+
+
+def fail_job():
+    raise RuntimeError('сбой задачи')
+
+
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = TwoTierCache(location, {'OPTIONS': {
+            'SYNC_INTERVAL': 0, 'LOCAL_TIMEOUT': 60}})
+        # Так пишет в общий файл другой рабочий процесс.
+        self.other_process = SQLiteCache(location, {})
+
+    def tearDown(self):
+        LocalTier._registry.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_local_tier_serves_repeated_reads(self):
+        """Повторное чтение берётся из памяти процесса."""
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['local_hits'], 2)
+        self.assertEqual(stats['shared_hits'], 0)
+
+    def test_shared_tier_fills_local_tier(self):
+        """Промах в памяти читается из общего уровня и запоминается."""
+        self.other_process.set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['shared_hits'], 1)
+        self.assertEqual(stats['local_hits'], 1)
+        self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(self.cache.get_stats()['shared_misses'], 1)
+
+    def test_invalidations_propagate_between_processes(self):
+        """Запись, удаление и очистка в другом процессе вытесняют
+        локальную копию."""
+        self.cache.set('key', 'old')
+        self.cache.get('key')
+        self.other_process.set('key', 'new')
+        self.assertEqual(self.cache.get('key'), 'new')
+        self.other_process.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.set('key', 'value')
+        self.other_process.clear()
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_incr_add_and_expiry(self):
+        """incr атомарен в общем уровне, add не перезаписывает,
+        истёкшие записи не отдаются."""
+        self.assertTrue(self.cache.add('counter', 1))
+        self.assertFalse(self.cache.add('counter', 5))
+        self.other_process.incr('counter')
+        self.assertEqual(self.cache.incr('counter'), 3)
+        self.assertEqual(self.cache.get('counter'), 3)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.cache.set('short', 'value', timeout=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('short'))
+
+
+@override_settings(SQL_QUERY_BUDGET=3, SQL_TIME_BUDGET_MS=1000,
+                   SQL_REPEAT_THRESHOLD=3, SQL_VIEW_BUDGETS={})
+class QueryInstrumentationTests(TestCase):
+    def get(self, view):
+        middleware = QueryInstrumentationMiddleware(view)
+        return middleware(RequestFactory().get('/'))
+
+    def test_warns_about_budget_and_repeated_queries(self):
+        def n_plus_one(request):
+            for pk in range(4):
+                User.objects.filter(pk=pk).exists()
+            return HttpResponse()
+
+        with self.assertLogs('core.sql', 'WARNING') as logs, \
+                mock.patch.object(metrics, 'inc') as inc:
+            self.get(n_plus_one)
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn('4 запросов при бюджете 3', logs.output[0])
+        self.assertIn('возможен N+1, 4 раз', logs.output[1])
+        inc.assert_any_call('yatube_db_queries_total', 4, view='unresolved')
+        inc.assert_any_call('yatube_sql_budget_exceeded_total',
+                            view='unresolved')
+
+    def test_quiet_within_budget(self):
+        def view(request):
+            list(User.objects.filter(pk__in=[1, 2]))
+            list(User.objects.filter(pk__in=[1, 2, 3]))
+            return HttpResponse()
+
+        with self.assertLogs('core.sql', 'WARNING') as logs:
+            self.get(view)
+            logging.getLogger('core.sql').warning('контроль')
+        self.assertEqual(len(logs.records), 1)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        settings = override_settings(
+            METRICS_PATH=os.path.join(self.directory, 'metrics.sqlite3'),
+            METRICS_FLUSH_INTERVAL=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # Соединение потока открыто к файлу из прошлых настроек.
+        metrics._local.pid = None
+        self.addCleanup(setattr, metrics._local, 'pid', None)
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        cache.clear()
+
+    def test_metrics_page(self):
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.get('/')
+        self.client.get('/')
+        self.assertEqual(self.client.get('/metrics/').status_code, 302)
+        self.client.force_login(staff)
+        content = self.client.get('/metrics/').content.decode()
+        self.assertIn('# TYPE yatube_http_request_duration_seconds '
+                      'histogram', content)
+        self.assertIn('yatube_http_requests_total{status="200",'
+                      'view="posts:index"} 2', content)
+        self.assertIn('yatube_http_request_duration_seconds_count'
+                      '{view="posts:index"} 2', content)
+        self.assertIn('yatube_template_render_seconds_count'
+                      '{template="posts/index.html"} 2', content)
+        self.assertIn('yatube_cache_requests_total'
+                      '{cache="template_fragments",result="local_hit"} 1',
+                      content)
+        buckets = [line for line in content.splitlines()
+                   if line.startswith('yatube_http_request_duration_seconds'
+                                      '_bucket{le=')]
+        self.assertTrue(buckets[-1].startswith(
+            'yatube_http_request_duration_seconds_bucket{le="+Inf"'))
+
+    def test_flushes_from_threads_are_summed(self):
+        """Приращения разных потоков и процессов складываются."""
+        def worker():
+            metrics.inc('yatube_http_requests_total', view='x', status=200)
+            metrics.flush()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        worker()
+        self.assertIn('yatube_http_requests_total{status="200",view="x"} 2',
+                      metrics.render())
+
+    @override_settings(METRICS_FLUSH_INTERVAL=3600)
+    def test_render_flushes_idle_threads(self):
+        """/metrics/ видит приращения потока, который простаивает."""
+        counted, finish = threading.Event(), threading.Event()
+
+        def worker():
+            metrics.inc('yatube_http_requests_total', view='x', status=200)
+            counted.set()
+            finish.wait()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(finish.set)
+        counted.wait()
+        self.assertIn('yatube_http_requests_total{status="200",view="x"} 1',
+                      metrics.render())
+
+    @override_settings(METRICS_FLUSH_INTERVAL=1)
+    def test_request_finished_flushes_when_due(self):
+        """Прошёл интервал — приращения сбрасываются по окончании запроса."""
+        metrics.inc('yatube_http_requests_total', view='x', status=200)
+        later = time.monotonic() + 2
+        with mock.patch('core.metrics.time.monotonic', return_value=later):
+            request_finished.send(sender=None)
+        rows = sqlite3.connect(settings.METRICS_PATH).execute(
+            'SELECT value FROM metrics WHERE name = ?',
+            ('yatube_http_requests_total',)).fetchall()
+        self.assertEqual(rows, [(1,)])
+
+
+class SQLiteBackendTests(SimpleTestCase):
+    databases = {'default'}
+
+    def test_pragmas_on_new_connection(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_dict = {**connection.settings_dict,
+                         'NAME': os.path.join(directory, 'db.sqlite3')}
+        wrapper = sqlite_base.DatabaseWrapper(settings_dict)
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            for pragma, expected in (('journal_mode', 'wal'),
+                                     ('synchronous', 1),
+                                     ('busy_timeout', 20000),
+                                     ('temp_store', 2)):
+                cursor.execute(f'PRAGMA {pragma}')
+                self.assertEqual(cursor.fetchone()[0], expected, pragma)
+
+    def test_retries_locked_query_outside_transaction(self):
+        calls = []
+
+        def locked(times):
+            calls.append(1)
+            if len(calls) <= times:
+                raise sqlite_base.Database.OperationalError(
+                    'database is locked')
+            return 'ok'
+
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(
+            factory=sqlite_base.CursorWrapper)
+        with mock.patch.object(sqlite_base, 'LOCK_RETRY_DELAY', 0):
+            self.assertEqual(cursor._retry(locked, 2), 'ok')
+            self.assertEqual(len(calls), 3)
+            calls.clear()
+            with self.assertRaises(sqlite_base.Database.OperationalError):
+                cursor._retry(locked, sqlite_base.LOCK_RETRIES + 1)
+            self.assertEqual(len(calls), sqlite_base.LOCK_RETRIES + 1)
+
+    def test_executemany_is_not_retried(self):
+        """Повтор executemany() вставил бы уже записанные строки."""
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(
+            factory=sqlite_base.CursorWrapper)
+        error = sqlite_base.Database.OperationalError('database is locked')
+        with mock.patch('django.db.backends.sqlite3.base.'
+                        'SQLiteCursorWrapper.executemany',
+                        side_effect=error) as executemany:
+            with self.assertRaises(sqlite_base.Database.OperationalError):
+                cursor.executemany('INSERT INTO t VALUES (%s)', [(1,)])
+        self.assertEqual(executemany.call_count, 1)
+
+    def test_benchmark_runs_through_django_connections(self):
+        out = StringIO()
+        call_command('sqlite_benchmark', readers=2, writers=2, seconds=0.3,
+                     rows=100, stdout=out)
+        rows = {line.split()[0]: line.split()
+                for line in out.getvalue().splitlines()[1:]}
+        self.assertEqual(set(rows), {'default', 'tuned'})
+        self.assertGreater(float(rows['tuned'][2]), 0)
+        self.assertEqual(rows['tuned'][-1], '0')
+        self.assertNotIn('sqlite_benchmark', connections.databases)
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """Реплика — отдельный файл, который обновляет только sync_replica."""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        replica = connections['replica']
+        replica.close()
+        name = replica.settings_dict['NAME']
+        replica.settings_dict['NAME'] = os.path.join(directory, 'replica')
+        self.addCleanup(replica.settings_dict.__setitem__, 'NAME', name)
+        self.addCleanup(replica.close)
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        Post.objects.create(author=self.author, text='Старый пост')
+        sync_replica()
+        self.client.force_login(self.author)
+
+    def get_posts(self, client, name, **kwargs):
+        response = client.get(reverse(name, kwargs=kwargs))
+        return [post.text for post in response.context['page_obj']]
+
+    def test_reads_stale_replica_until_sync(self):
+        Post.objects.create(author=self.author, text='Новый пост')
+        url = reverse('posts:index')
+        self.assertNotContains(self.client_class().get(url), 'Новый пост')
+        # Фрагмент со старой копии не достаётся читателю основной базы.
+        pinned = self.client_class()
+        pinned.cookies[PIN_COOKIE] = '1'
+        self.assertContains(pinned.get(url), 'Новый пост')
+        sync_replica()
+        self.assertContains(self.client_class().get(url), 'Новый пост')
+
+    def test_validators_change_after_sync(self):
+        url = reverse('posts:profile', kwargs={'username': 'author'})
+        response = self.client_class().get(url)
+        post = Post.objects.get()
+        post.text = 'Исправленный пост'
+        post.save()
+        response = self.client_class().get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(response, 'Старый пост')
+        sync_replica()
+        response = self.client_class().get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'],
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertContains(response, 'Исправленный пост')
+
+    def test_password_change_keeps_session(self):
+        self.author.set_password('old-secret-17')
+        self.author.save()
+        self.client.login(username='author', password='old-secret-17')
+        response = self.client.post(reverse('users:password_change'), {
+            'old_password': 'old-secret-17',
+            'new_password1': 'new-secret-42',
+            'new_password2': 'new-secret-42',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        # Новый хеш пароля есть только в основной базе.
+        del self.client.cookies[PIN_COOKIE]
+        response = self.client.get(reverse('posts:index'))
+        self.assertTrue(response.context['user'].is_authenticated)
+        response = self.client.get(reverse('posts:post_create'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_author_is_pinned_to_primary_after_write(self):
+        response = self.client.post(reverse('posts:post_create'),
+                                    {'text': 'Новый пост'})
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(
+            len(self.get_posts(self.client, 'posts:profile',
+                               username='author')), 2)
+        self.assertEqual(
+            self.get_posts(self.client_class(), 'posts:profile',
+                           username='author'), ['Старый пост'])
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_deferred_job_runs_once(self):
+        jobs.defer(record_call, 1, text='ё')
+        self.assertEqual(CALLS, [])
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(CALLS, [((1,), {'text': 'ё'})])
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_claimed_job_is_not_claimed_again(self):
+        jobs.defer(record_call)
+        self.assertEqual(len(jobs.claim('first', 10)), 1)
+        self.assertEqual(jobs.claim('second', 10), [])
+        # Воркер пропал: после JOBS_LOCK_TIMEOUT задачу можно взять.
+        Job.objects.update(locked_at=timezone.now() - timedelta(days=1))
+        job, = jobs.claim('second', 10)
+        self.assertEqual(job.attempts, 2)
+        self.assertTrue(job.locked_by.startswith('second:'))
+
+    @override_settings(JOBS_MAX_ATTEMPTS=2)
+    def test_failed_job_retries_with_backoff_then_dies(self):
+        jobs.defer(fail_job)
+        with self.assertLogs('core.jobs', 'WARNING'):
+            jobs.run_pending()
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('сбой задачи', job.last_error)
+        self.assertEqual(jobs.run_pending(), 0)
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DEAD, 2))
+        self.assertEqual(jobs.run_pending(), 0)
+
+    @override_settings(
+        EMAIL_BACKEND='core.mail.QueuedEmailBackend',
+        QUEUED_EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_email_is_sent_by_job(self):
+        mail.send_mail('Тема', 'Текст', 'from@yatube.ru', ['to@yatube.ru'],
+                       html_message='<b>Текст</b>')
+        self.assertEqual(mail.outbox, [])
+        jobs.run_pending()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Тема')
+        self.assertEqual(mail.outbox[0].to, ['to@yatube.ru'])
+        self.assertEqual(mail.outbox[0].alternatives,
+                         [['<b>Текст</b>', 'text/html']])
+
+
+class WorkerCommandTests(TransactionTestCase):
+    @override_settings(JOBS_ALWAYS_EAGER=False)
+    def test_worker_runs_jobs_in_threads(self):
+        CALLS.clear()
+        for number in range(5):
+            jobs.defer(record_call, number)
+        out = StringIO()
+        call_command('worker', once=True, threads=2, stdout=out)
+        self.assertIn('Выполнено задач: 5', out.getvalue())
+        self.assertCountEqual(CALLS, [((number,), {})
+                                      for number in range(5)])
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(JOBS_ALWAYS_EAGER=True)
+    def test_eager_jobs_run_after_commit_without_worker(self):
+        CALLS.clear()
+        with transaction.atomic():
+            jobs.defer(record_call, 1)
+            jobs.defer(record_call, 2, delay=60)
+            self.assertEqual(CALLS, [])
+        self.assertEqual(CALLS, [((1,), {})])
+        self.assertEqual(Job.objects.count(), 1)
@@ -1,6 +1,8 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import SEARCH_VAR
 
 from .models import Comment, Group, Post
+from .search import is_available, search_posts
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -16,6 +18,21 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        # Порядок задаёт ChangeList (по рангу — get_ordering ниже), а не
+        # extra(order_by) поиска: иначе он зависел бы от того, до или
+        # после сортировки списка вызван поиск, и перекрывал бы выбранную
+        # пользователем колонку.
+        ordering = queryset.query.order_by
+        return search_posts(search_term, queryset).order_by(*ordering), False
+
+    def get_ordering(self, request):
+        if request.GET.get(SEARCH_VAR) and is_available():
+            return ('rank', '-pub_date')
+        return super().get_ordering(request)
+
 
 class CommentAdmin(admin.ModelAdmin):
     list_display = (
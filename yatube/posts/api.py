@@ -0,0 +1,138 @@
+"""JSON-версии лент только для чтения: главная, группа, профиль, подписки.
+
+Пагинация только курсорная. ?fields=id,text,author выбирает поля ответа
+и превращается в .only(), так что ненужные столбцы не читаются из базы.
+Ответ пишется потоком, по одному посту, а не собирается в один dict.
+"""
+import json
+
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from .follow_graph import following_states
+from .models import Group, Post, User
+from .paginators import CURSOR_ORDERING, CursorPaginator
+from .timeline import FEED_ORDERING, get_feed
+
+API_PAGE = 10
+# Поле ответа: (пути для .only(), связь для select_related, значение).
+FIELDS = {
+    'id': ((), None, lambda post: post.pk),
+    'text': (('text',), None, lambda post: post.text),
+    'pub_date': ((), None, lambda post: post.pub_date.isoformat()),
+    'author': (('author__username',), 'author',
+               lambda post: post.author.username),
+    'group': (('group__slug',), 'group',
+              lambda post: post.group.slug if post.group_id else None),
+    'image': (('image',), None,
+              lambda post: post.image.url if post.image else None),
+    'comments_count': (('comments_count',), None,
+                       lambda post: post.comments_count),
+    # Подписан ли текущий пользователь на автора; считается на всю
+    # страницу сразу в feed_response.
+    'following': (('author',), None, lambda post: post.author_following),
+}
+
+
+def parse_fields(raw):
+    """Имена полей из ?fields=; ValueError для неизвестных."""
+    if not raw:
+        return tuple(FIELDS)
+    fields = tuple(dict.fromkeys(
+        name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown or not fields:
+        raise ValueError(f'Неизвестные поля: {", ".join(unknown)}')
+    return fields
+
+
+def project(queryset, fields, prefix=''):
+    """Оставляет в запросе только столбцы выбранных полей и курсора."""
+    only = {f'{prefix}pub_date'}
+    related = []
+    for name in fields:
+        paths, relation, _ = FIELDS[name]
+        only.update(f'{prefix}{path}' for path in paths)
+        if relation:
+            related.append(f'{prefix}{relation}')
+    if prefix:
+        # Курсор строится по полям самой записи ленты, а не поста.
+        only.update(('pub_date', prefix.rstrip('_')))
+        related.append(prefix.rstrip('_'))
+    only.update(related)
+    return queryset.select_related(None).select_related(*related).only(*only)
+
+
+def serialize(post, fields):
+    return {name: FIELDS[name][2](post) for name in fields}
+
+
+def stream_page(page, fields, get_post):
+    yield '{"results": ['
+    for index, obj in enumerate(page):
+        item = json.dumps(serialize(get_post(obj), fields),
+                          ensure_ascii=False)
+        yield f',{item}' if index else item
+    yield (f'], "next": {json.dumps(page.next_cursor)},'
+           f' "previous": {json.dumps(page.previous_cursor)}}}')
+
+
+def error(message, status):
+    return JsonResponse({'detail': message}, status=status,
+                        json_dumps_params={'ensure_ascii': False})
+
+
+def feed_response(request, queryset, prefix='', ordering=CURSOR_ORDERING):
+    try:
+        fields = parse_fields(request.GET.get('fields'))
+    except ValueError as exc:
+        return error(str(exc), 400)
+    queryset = project(queryset, fields, prefix)
+    page = CursorPaginator(queryset, API_PAGE, ordering).get_page(
+        request.GET.get('cursor'))
+    if prefix:
+        def get_post(entry):
+            return entry.post
+    else:
+        def get_post(post):
+            return post
+    if 'following' in fields:
+        posts = [get_post(obj) for obj in page]
+        states = following_states(request.user,
+                                  {post.author_id for post in posts})
+        for post in posts:
+            post.author_following = states[post.author_id]
+    return StreamingHttpResponse(
+        stream_page(page, fields, get_post),
+        content_type='application/json; charset=utf-8')
+
+
+@require_GET
+def index(request):
+    return feed_response(request, Post.objects.all())
+
+
+@require_GET
+def group_posts(request, slug):
+    group_id = (Group.objects.filter(slug=slug)
+                .values_list('pk', flat=True).first())
+    if group_id is None:
+        return error('Группа не найдена', 404)
+    return feed_response(request, Post.objects.filter(group_id=group_id))
+
+
+@require_GET
+def profile(request, username):
+    author_id = (User.objects.filter(username=username)
+                 .values_list('pk', flat=True).first())
+    if author_id is None:
+        return error('Пользователь не найден', 404)
+    return feed_response(request, Post.objects.filter(author_id=author_id))
+
+
+@require_GET
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return error('Требуется авторизация', 401)
+    return feed_response(request, get_feed(request.user), prefix='post__',
+                         ordering=FEED_ORDERING)
@@ -0,0 +1,261 @@
+"""Сквозной бенчмарк страниц posts.urls на сгенерированных данных.
+
+seed() наполняет базу пользователями, группами и подписками через mixer,
+а посты и комментарии с текстом от Faker загружает командой import_posts.
+run() проходит тестовым клиентом по каждому маршруту posts.urls и
+считает перцентили времени ответа, число SQL-запросов и размер ответа.
+Каждый маршрут запрашивается так, чтобы дойти до его основной ветки
+(ROUTES), а неожиданный статус ответа попадает в результаты.
+render_feed() отдельно от базы замеряет рендеринг постов ленты.
+"""
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.template import Context, Engine
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from faker import Faker
+from mixer.backend.django import mixer
+
+from . import urls
+from .models import Follow, Group, Post, User, prepare_posts
+
+VOLUMES = {
+    'users': 50,
+    'groups': 5,
+    'posts': 1000,
+    'comments': 2000,
+    'follows': 200,
+}
+READER_FOLLOWS = 20
+# Та же разметка поста, что в posts/index.html.
+FEED_TEMPLATE = (
+    "{% for post in page_obj %}{% include 'includes/one_post.html' %}"
+    "{% if post.group_url %}<a href=\"{{ post.group_url }}\">все записи "
+    "группы</a>{% endif %}{% endfor %}"
+)
+PERCENTILES = (50, 95, 99)
+
+
+def follow_author(context):
+    Follow.objects.get_or_create(user=context['reader'],
+                                 author=context['author'])
+
+
+def unfollow_author(context):
+    Follow.objects.filter(user=context['reader'],
+                          author=context['author']).delete()
+
+
+# Как дойти до основной ветки маршрута: кто запрашивает, метод, данные
+# запроса, подготовка перед каждым запросом (вне замера) и ожидаемый
+# статус. Остальные маршруты — GET от читателя с ответом 200.
+ROUTES = {
+    'search': {'data': lambda context: {'q': context['query']}},
+    'post_edit': {'user': 'post_author'},
+    'add_comment': {'method': 'post', 'status': 302,
+                    'data': lambda context: {'text': 'Комментарий'}},
+    'profile_follow': {'prepare': unfollow_author, 'status': 302},
+    'profile_unfollow': {'prepare': follow_author, 'status': 302},
+}
+
+
+def percentile(values, rank):
+    """Перцентиль по ближайшему рангу."""
+    values = sorted(values)
+    index = max(0, -(-len(values) * rank // 100) - 1)
+    return values[index]
+
+
+def _records(volumes, users, groups, fake):
+    for number in range(volumes['posts']):
+        group = random.choice(groups + [None]) if groups else None
+        yield {
+            'id': number,
+            'author': random.choice(users).username,
+            'group': group and group.slug,
+            'text': fake.text(),
+            'pub_date': fake.date_time_between('-1y').isoformat(),
+        }
+    for _ in range(volumes['comments'] if volumes['posts'] else 0):
+        yield {
+            'type': 'comment',
+            'post': random.randrange(volumes['posts']),
+            'author': random.choice(users).username,
+            'text': fake.sentence(),
+            'created': fake.date_time_between('-1y').isoformat(),
+        }
+
+
+def seed(volumes=VOLUMES, seed_value=0):
+    """Наполняет базу и возвращает значения для аргументов маршрутов."""
+    volumes = {**VOLUMES, **volumes}
+    random.seed(seed_value)
+    fake = Faker('ru_RU')
+    fake.seed_instance(seed_value)
+    users = mixer.cycle(max(volumes['users'], 2)).blend(
+        User, username=mixer.sequence('user{0}'))
+    groups = mixer.cycle(volumes['groups']).blend(
+        Group, slug=mixer.sequence('group-{0}'))
+    reader, authors = users[0], users[1:]
+    pairs = {(reader.pk, author.pk) for author in authors[:READER_FOLLOWS]}
+    while len(pairs) < min(volumes['follows'],
+                           len(users) * (len(users) - 1)):
+        user, author = random.sample(users, 2)
+        pairs.add((user.pk, author.pk))
+    by_pk = {user.pk: user for user in users}
+    for user_id, author_id in pairs:
+        mixer.blend(Follow, user=by_pk[user_id], author=by_pk[author_id])
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'seed.ndjson')
+        with open(path, 'w') as file:
+            for record in _records(volumes, users, groups, fake):
+                file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        call_command('import_posts', path, stdout=StringIO())
+    # Автор профиля — не сам читатель: иначе подписка не создаётся.
+    author = (User.objects.exclude(pk=reader.pk)
+              .annotate(total=Count('posts')).order_by('-total').first())
+    post = (Post.objects.select_related('author')
+            .order_by('-comments_count', '-pk').first())
+    words = [word.strip('.,') for word in post.text.split()] if post else []
+    return {
+        'reader': reader,
+        'author': author,
+        'username': author.username,
+        'slug': groups[0].slug if groups else 'missing',
+        'post_id': post.pk if post else 0,
+        'post_author': post.author if post else reader,
+        'query': max(words, key=len, default='пост'),
+    }
+
+
+def get_urls(context):
+    """Имя и адрес каждого маршрута posts.urls."""
+    for pattern in urls.urlpatterns:
+        kwargs = {name: context[name]
+                  for name in pattern.pattern.converters}
+        yield pattern.name, reverse(f'{urls.app_name}:{pattern.name}',
+                                    kwargs=kwargs)
+
+
+def measure(client, url, requests, method='get', data=None, prepare=None,
+            expected=200):
+    """Первый запрос на пустом кэше и перцентили остальных.
+
+    prepare() вызывается перед каждым запросом и в замер не входит. В
+    status попадает первый ответ с неожиданным статусом, если он был.
+    """
+    cache.clear()
+    timings, queries, status = [], [], expected
+    for _ in range(max(requests, 2)):
+        if prepare is not None:
+            prepare()
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data, HTTP_REFERER=url)
+            if response.streaming:
+                body = b''.join(response.streaming_content)
+            else:
+                body = response.content
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(context.captured_queries))
+        if status == expected:
+            status = response.status_code
+    warm = timings[1:]
+    result = {
+        'url': url,
+        'status': status,
+        'expected_status': expected,
+        'bytes': len(body),
+        'cold_ms': round(timings[0], 3),
+        'cold_queries': queries[0],
+        'queries': percentile(queries[1:], 50),
+    }
+    for rank in PERCENTILES:
+        result[f'p{rank}_ms'] = round(percentile(warm, rank), 3)
+    return result
+
+
+def run(context, requests=50):
+    clients = {}
+    results = {}
+    for name, url in get_urls(context):
+        route = ROUTES.get(name, {})
+        user = context[route.get('user', 'reader')]
+        if user.pk not in clients:
+            clients[user.pk] = Client()
+            clients[user.pk].force_login(user)
+        data = route.get('data')
+        prepare = route.get('prepare')
+        results[name] = measure(
+            clients[user.pk], url, requests,
+            method=route.get('method', 'get'),
+            data=data and data(context),
+            prepare=prepare and (lambda: prepare(context)),
+            expected=route.get('status', 200))
+    return results
+
+
+def unexpected_statuses(results):
+    """Маршруты, которые ответили не тем статусом, что ожидался."""
+    return {name: result['status'] for name, result in results.items()
+            if result['status'] != result['expected_status']}
+
+
+def make_engine(cached):
+    """Движок как у проекта, с кэширующим загрузчиком или без него."""
+    engine = Engine.get_default()
+    loaders = [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]
+    if cached:
+        loaders = [('django.template.loaders.cached.Loader', loaders)]
+    return Engine(dirs=engine.dirs, loaders=loaders,
+                  libraries=engine.libraries)
+
+
+def make_posts(count):
+    """Несохранённые посты: рендеринг замеряется без запросов к базе."""
+    authors = [User(pk=number, username=f'user{number}',
+                    first_name='Имя', last_name='Фамилия')
+               for number in range(5)]
+    groups = [Group(pk=number, slug=f'group-{number}', title='Группа')
+              for number in range(3)]
+    now = timezone.now()
+    return [Post(pk=number, text='Текст поста ' * 20,
+                 author=authors[number % len(authors)],
+                 group=groups[number % 4] if number % 4 < 3 else None,
+                 pub_date=now - timedelta(hours=number * 7))
+            for number in range(count)]
+
+
+def render_feed(count=10, repeats=200):
+    """Микросекунды рендеринга на пост: без кэша шаблонов, с ним и с
+    заранее подготовленными постами."""
+    results = {}
+    for name, cached, prepared in (('uncached', False, False),
+                                   ('cached', True, False),
+                                   ('cached_prepared', True, True)):
+        template = make_engine(cached).from_string(FEED_TEMPLATE)
+        timings = []
+        for _ in range(repeats):
+            posts = make_posts(count)
+            started = time.perf_counter()
+            if prepared:
+                prepare_posts(posts)
+            template.render(Context({'page_obj': posts}))
+            timings.append((time.perf_counter() - started) * 1e6 / count)
+        results[name] = round(percentile(timings, 50), 1)
+    return results
@@ -0,0 +1,81 @@
+"""Условный GET (ETag / Last-Modified) для страниц постов.
+
+Last-Modified — самая свежая дата на странице из одного агрегата по
+индексу, но не раньше последнего изменения постов этой страницы: у
+группы, автора и поста своё поколение в feed_cache, поэтому правки и
+удаления сбрасывают валидаторы только затронутых страниц. ETag
+дополнительно учитывает пользователя (и его подписки) и параметры
+страницы: разметка зависит от них. Страница, прочитанная с реплики,
+меняется и после каждого sync_replica.
+
+latest_in_* возвращают дату и поколения страницы; (None, ()) — на
+странице нечего кэшировать. Пост зависит и от поколения автора: на
+странице поста выводится число его постов.
+"""
+import hashlib
+
+from django.db.models import Max
+from django.views.decorators.http import condition
+
+from core.replica import reads_from_replica, synced_at
+
+from .feed_cache import (author_scope, follow_scope, get_changed_at,
+                         get_generation, group_scope, post_scope,
+                         replica_version)
+from .models import Comment, Post
+
+
+def latest_in_group(slug):
+    result = (Post.objects.filter(group__slug=slug)
+              .aggregate(latest=Max('pub_date'), group_id=Max('group_id')))
+    return result['latest'], (group_scope(result['group_id']),)
+
+
+def latest_in_profile(username):
+    result = (Post.objects.filter(author__username=username)
+              .aggregate(latest=Max('pub_date'),
+                         author_id=Max('author_id')))
+    return result['latest'], (author_scope(result['author_id']),)
+
+
+def latest_in_post(post_id):
+    post = (Post.objects.filter(pk=post_id)
+            .values_list('pub_date', 'author_id').first())
+    if post is None:
+        return None, ()
+    pub_date, author_id = post
+    last_comment = (Comment.objects.filter(post_id=post_id)
+                    .aggregate(latest=Max('created'))['latest'])
+    return (max(filter(None, (pub_date, last_comment))),
+            (post_scope(post_id), author_scope(author_id)))
+
+
+def conditional_page(latest_func):
+    """Отдаёт 304 до вызова view, если страница не менялась."""
+    def validators(request, kwargs):
+        if not hasattr(request, '_posts_validators'):
+            latest, scopes = latest_func(**kwargs)
+            if latest is not None:
+                changed = [get_changed_at(scope) for scope in scopes]
+                if reads_from_replica():
+                    changed.append(synced_at())
+                latest = max([latest, *filter(None, changed)])
+            request._posts_validators = latest, scopes
+        return request._posts_validators
+
+    def last_modified(request, **kwargs):
+        return validators(request, kwargs)[0]
+
+    def etag(request, **kwargs):
+        modified, scopes = validators(request, kwargs)
+        if modified is None:
+            return None
+        user = request.user if request.user.is_authenticated else None
+        parts = [request.path, request.GET.urlencode(), user and user.pk,
+                 *map(get_generation, scopes), modified.isoformat(),
+                 replica_version()]
+        if user is not None:
+            parts.append(get_generation(follow_scope(user.pk)))
+        return hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
@@ -0,0 +1,72 @@
+"""Денормализованные счётчики постов, подписок и комментариев.
+
+Счётчики меняются сигналами через UPDATE ... SET x = x + 1, поэтому шаблоны
+и пагинатор профиля не делают COUNT. Если счётчики разошлись с данными,
+их пересобирает команда recount_counters.
+"""
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .models import Comment, Follow, Post, UserCounters
+
+USER_COUNTERS = {
+    'posts_count': (Post, 'author'),
+    'followers_count': (Follow, 'author'),
+    'following_count': (Follow, 'user'),
+}
+
+
+def _count_by(model, field, ids):
+    return dict(
+        model.objects.filter(**{f'{field}__in': ids})
+        .order_by().values(field).annotate(total=Count('pk'))
+        .values_list(field, 'total')
+    )
+
+
+def recount_users(user_ids):
+    """Пересчитывает счётчики пачки пользователей с нуля."""
+    user_ids = list(user_ids)
+    totals = {
+        name: _count_by(model, field, user_ids)
+        for name, (model, field) in USER_COUNTERS.items()
+    }
+    counters = [
+        UserCounters(user_id=user_id, **{
+            name: totals[name].get(user_id, 0) for name in USER_COUNTERS
+        })
+        for user_id in user_ids
+    ]
+    existing = set(UserCounters.objects.filter(user_id__in=user_ids)
+                   .values_list('user_id', flat=True))
+    UserCounters.objects.bulk_update(
+        [item for item in counters if item.user_id in existing],
+        list(USER_COUNTERS))
+    UserCounters.objects.bulk_create(
+        [item for item in counters if item.user_id not in existing],
+        ignore_conflicts=True)
+
+
+def recount_posts(post_ids):
+    """Пересчитывает comments_count пачки постов с нуля."""
+    post_ids = list(post_ids)
+    totals = _count_by(Comment, 'post', post_ids)
+    Post.objects.bulk_update(
+        [Post(pk=post_id, comments_count=totals.get(post_id, 0))
+         for post_id in post_ids],
+        ['comments_count'])
+
+
+def change_user_counters(user_id, **deltas):
+    updated = UserCounters.objects.filter(user_id=user_id).update(**{
+        name: Greatest(F(name) + delta, 0) for name, delta in deltas.items()
+    })
+    # Строки нет у пользователей до миграции; при удалении (каскад от User)
+    # её не создаём, иначе она переживёт самого пользователя.
+    if not updated and any(delta > 0 for delta in deltas.values()):
+        recount_users([user_id])
+
+
+def change_comments_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=Greatest(F('comments_count') + delta, 0))
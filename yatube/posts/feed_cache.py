@@ -0,0 +1,94 @@
+"""Поколения для ключей фрагментного кэша лент.
+
+Ключ {% cache %} включает номер поколения, поэтому при изменении постов или
+подписок достаточно увеличить счётчик: старые фрагменты больше не читаются
+и доживают свой TTL, а TTL самих фрагментов можно держать часами.
+
+Запрос, читающий с реплики, видит данные на момент sync_replica, хотя
+поколение уже увеличено записью в основную базу. Поэтому его ключи
+получают ещё и метку копии (replica_version): иначе устаревший фрагмент
+лёг бы под новым поколением и дожил бы до следующей правки.
+"""
+import time
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from core import replica
+
+POSTS_SCOPE = 'posts'
+
+
+def follow_scope(user_id):
+    return f'follow:{user_id}'
+
+
+def group_scope(group_id):
+    return f'group:{group_id}'
+
+
+def author_scope(author_id):
+    return f'author:{author_id}'
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def post_scopes(post):
+    """Страницы, на которых виден пост: сам пост, профиль и группа."""
+    scopes = [post_scope(post.pk), author_scope(post.author_id)]
+    if post.group_id is not None:
+        scopes.append(group_scope(post.group_id))
+    return scopes
+
+
+def _key(scope):
+    return f'posts:generation:{scope}'
+
+
+def _initial_generation():
+    # Счётчик мог быть вытеснен раньше фрагментов: начинаем не с 1,
+    # чтобы не совпасть с поколением уцелевших старых фрагментов.
+    return int(time.time() * 1000)
+
+
+def get_generation(scope):
+    key = _key(scope)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _initial_generation(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(scope):
+    try:
+        cache.incr(_key(scope))
+    except ValueError:
+        cache.add(_key(scope), _initial_generation(), None)
+    cache.set(f'{_key(scope)}:changed', timezone.now(), None)
+
+
+def get_changed_at(scope):
+    """Время последнего bump_generation или None, если оно вытеснено."""
+    return cache.get(f'{_key(scope)}:changed')
+
+
+def replica_version():
+    """Метка копии реплики, если запрос читает с неё, иначе ''."""
+    if not replica.reads_from_replica():
+        return ''
+    synced = replica.synced_at()
+    return f'r{synced.timestamp() if synced else 0}'
+
+
+def get_feed_generation(user=None):
+    """Поколение ленты; для ленты подписок учитывает и подписки user."""
+    generation = str(get_generation(POSTS_SCOPE))
+    if user is not None:
+        generation += f'.{get_generation(follow_scope(user.pk))}'
+    version = replica_version()
+    if version:
+        generation += f'.{version}'
+    return generation
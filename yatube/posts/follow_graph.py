@@ -0,0 +1,35 @@
+"""Подписки пользователя в кэше: проверки «подписан ли» без запросов.
+
+Множество id авторов, на которых подписан пользователь, лежит в кэше под
+ключом с поколением follow_scope(user_id) из feed_cache. Подписка и
+отписка и так увеличивают это поколение, поэтому старое множество
+просто перестаёт читаться и отдельная инвалидация не нужна.
+Множество, прочитанное с реплики, лежит под своим ключом с её меткой.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .feed_cache import follow_scope, get_generation, replica_version
+from .models import Follow
+
+
+def _key(user_id):
+    generation = get_generation(follow_scope(user_id))
+    return f'posts:following:{user_id}:{generation}{replica_version()}'
+
+
+def get_following_ids(user_id):
+    """frozenset id авторов, на которых подписан user_id."""
+    def load():
+        return frozenset(Follow.objects.filter(user_id=user_id)
+                         .values_list('author_id', flat=True))
+    return cache.get_or_set(_key(user_id), load,
+                            settings.FOLLOWING_CACHE_TIMEOUT)
+
+
+def following_states(user, author_ids):
+    """{author_id: подписан ли user} для кнопок «Подписаться» списком."""
+    if not user.is_authenticated:
+        return dict.fromkeys(author_ids, False)
+    following = get_following_ids(user.pk)
+    return {author_id: author_id in following for author_id in author_ids}
@@ -1,9 +1,17 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from .images import normalize_image
 from .models import Comment, Post
 
 
 class PostForm(forms.ModelForm):
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            return normalize_image(image) or image
+        return image
+
     class Meta:
         model = Post
         fields = ('text', 'group', 'image')
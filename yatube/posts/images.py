@@ -0,0 +1,181 @@
+"""Картинки постов: нормализация загрузки и варианты по ширине.
+
+normalize_image() при загрузке поворачивает картинку по EXIF, уменьшает
+её до IMAGE_MAX_SIZE по большей стороне и пересохраняет без метаданных.
+save_variants() режет кадр 960x339, как раньше делал sorl, в ширинах
+IMAGE_VARIANT_WIDTHS не шире исходника и сохраняет каждую в WebP (если
+Pillow собран с libwebp) и JPEG.
+Готовые ширины записываются в Post.image_widths, и тег post_image
+выводит <picture> с srcset, так что телефон скачивает узкий WebP, а не
+кадр 960 пикселей.
+image_metadata() один раз при сохранении считает размеры картинки и
+заглушку — размытый PNG в пару сотен байт, который лента вставляет прямо
+в разметку, пока грузится сама картинка.
+"""
+import base64
+import io
+import os
+import re
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageFilter, ImageOps
+
+from core import metrics
+
+VARIANTS_DIR = 'posts/variants/'
+ASPECT_RATIO = 960 / 339
+VARIANT_NAME = re.compile(
+    r'^(?P<source>.+)_(?P<width>\d+)w\.(?P<extension>\w+)$')
+# Заглушка с пропорциями кадра: 16x6 в PNG — около 200 байт.
+PLACEHOLDER_SIZE = (16, 6)
+# Формат: (расширение, формат Pillow, MIME, параметры). Первые —
+# предпочтительные, последний (JPEG) понимают все браузеры.
+FORMATS = (
+    ('webp', 'WEBP', 'image/webp', {'quality': 75, 'method': 4}),
+    ('jpg', 'JPEG', 'image/jpeg', {'quality': 80, 'optimize': True,
+                                   'progressive': True}),
+)
+# Форматы, в которых бывает EXIF; GIF не трогаем, чтобы не потерять
+# анимацию.
+REENCODE_FORMATS = {'JPEG': {'quality': 90}, 'PNG': {'optimize': True},
+                    'WEBP': {'quality': 90}}
+
+
+def normalize_image(file):
+    """ContentFile без EXIF и не больше IMAGE_MAX_SIZE или None, если
+    файл не нужно менять."""
+    file.seek(0)
+    with Image.open(file) as image:
+        options = REENCODE_FORMATS.get(image.format)
+        if options is None:
+            return None
+        image_format = image.format
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((settings.IMAGE_MAX_SIZE, settings.IMAGE_MAX_SIZE),
+                        Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, image_format, **options)
+    return ContentFile(buffer.getvalue(), name=os.path.basename(file.name))
+
+
+def variant_formats():
+    """FORMATS, которые умеет сохранять установленный Pillow: WebP
+    зависит от того, собран ли он с libwebp."""
+    Image.init()
+    return [variant for variant in FORMATS if variant[1] in Image.SAVE]
+
+
+def frame_size(width):
+    """Размер кадра ленты шириной width."""
+    return width, max(1, round(width / ASPECT_RATIO))
+
+
+def variant_name(image_name, width, extension):
+    # Имя исходника целиком, с расширением: у старых загрузок cat.jpg и
+    # cat.png разные картинки, и варианты у них тоже должны быть свои.
+    source = os.path.basename(image_name)
+    return f'{VARIANTS_DIR}{source}_{width}w.{extension}'
+
+
+def parse_variant_name(name):
+    """(имя исходника без каталога, ширина, расширение) из имени файла
+    варианта или None."""
+    match = VARIANT_NAME.match(name)
+    if match is None:
+        return None
+    return match['source'], int(match['width']), match['extension']
+
+
+def variant_widths(source_width):
+    """Ширины вариантов без увеличения; хотя бы одна."""
+    widths = [width for width in settings.IMAGE_VARIANT_WIDTHS
+              if width <= source_width]
+    return widths or [source_width]
+
+
+def _flatten(image):
+    # У JPEG нет прозрачности: прозрачное ложится на белый фон.
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _open_source(image_name):
+    with default_storage.open(image_name) as file, Image.open(file) as image:
+        return _flatten(image)
+
+
+def _save_variant(image_name, frame, width, extension):
+    # Готовый файл не пересоздаётся: его может отдавать веб-сервер, а
+    # содержимое по тому же имени всё равно получилось бы тем же.
+    name = variant_name(image_name, width, extension)
+    if default_storage.exists(name):
+        return
+    image_format, options = next(
+        (image_format, options)
+        for ext, image_format, _, options in FORMATS if ext == extension)
+    with metrics.timer('yatube_thumbnail_seconds',
+                       geometry=f'{width}w.{extension}'):
+        buffer = io.BytesIO()
+        frame.save(buffer, image_format, **options)
+    default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def save_variants(image_name):
+    """Создаёт недостающие варианты картинки и возвращает их ширины."""
+    image = _open_source(image_name)
+    widths = variant_widths(image.width)
+    for width in widths:
+        frame = ImageOps.fit(image, frame_size(width), Image.LANCZOS)
+        for extension, *_ in variant_formats():
+            _save_variant(image_name, frame, width, extension)
+    return widths
+
+
+def save_variant(image_name, width, extension):
+    """Создаёт один вариант картинки, если его ещё нет."""
+    frame = ImageOps.fit(_open_source(image_name), frame_size(width),
+                         Image.LANCZOS)
+    _save_variant(image_name, frame, width, extension)
+
+
+def image_metadata(file):
+    """Значения полей Post.image_width, image_height и
+    image_placeholder для картинки file."""
+    file.seek(0)
+    with Image.open(file) as image:
+        image = _flatten(image)
+    placeholder = ImageOps.fit(image, PLACEHOLDER_SIZE, Image.LANCZOS)
+    buffer = io.BytesIO()
+    placeholder.filter(ImageFilter.GaussianBlur(1)).save(
+        buffer, 'PNG', optimize=True)
+    return {
+        'image_width': image.width,
+        'image_height': image.height,
+        'image_placeholder': 'data:image/png;base64,'
+                             + base64.b64encode(buffer.getvalue()).decode(),
+    }
+
+
+def delete_variants(image_name, widths):
+    for width in widths:
+        for extension, *_ in FORMATS:
+            default_storage.delete(variant_name(image_name, width,
+                                                extension))
+
+
+def srcsets(image_name, widths):
+    """[(MIME, srcset)] сохранённых вариантов, JPEG последним."""
+    return [
+        (mime, ', '.join(
+            f'{default_storage.url(variant_name(image_name, width, ext))}'
+            f' {width}w'
+            for width in widths))
+        for ext, _, mime, _ in variant_formats()
+    ]
@@ -0,0 +1,96 @@
+import json
+import os
+import platform
+import sqlite3
+import tempfile
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (override_settings, setup_databases,
+                               setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+
+from posts import benchmark
+
+COLUMNS = ('status', 'p50_ms', 'p95_ms', 'p99_ms', 'cold_ms', 'queries',
+           'cold_queries', 'bytes')
+
+
+class Command(BaseCommand):
+    help = ('Наполняет временную тестовую базу и замеряет все страницы '
+            'posts.urls: перцентили времени, число запросов и размер '
+            'ответа. Рабочая база и кэш не затрагиваются.')
+
+    def add_arguments(self, parser):
+        for name, default in benchmark.VOLUMES.items():
+            parser.add_argument(f'--{name}', type=int, default=default,
+                                help=f'Сколько создать ({name}).')
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Запросов на каждый адрес.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Сохранить результаты в JSON.')
+        parser.add_argument('--compare',
+                            help='JSON прошлого прогона для сравнения p95.')
+
+    def handle(self, *args, **options):
+        volumes = {name: options[name] for name in benchmark.VOLUMES}
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                # Кэш, картинки и метрики — тоже во временном каталоге.
+                location = os.path.join(directory, 'cache.sqlite3')
+                caches = {alias: {**config, 'LOCATION': location}
+                          for alias, config in settings.CACHES.items()}
+                with override_settings(
+                        CACHES=caches, MEDIA_ROOT=directory,
+                        METRICS_PATH=os.path.join(directory, 'metrics')):
+                    context = benchmark.seed(volumes, options['seed'])
+                    results = benchmark.run(context, options['requests'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+        previous = {}
+        if options['compare']:
+            with open(options['compare']) as file:
+                previous = json.load(file)['results']
+        self.print_table(results, previous)
+        if options['output']:
+            report = {
+                'volumes': volumes,
+                'requests': options['requests'],
+                'environment': {
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'sqlite': sqlite3.sqlite_version,
+                },
+                'results': results,
+            }
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+        unexpected = benchmark.unexpected_statuses(results)
+        if unexpected:
+            raise CommandError(
+                'Замерены не те ответы: ' + ', '.join(
+                    f'{name} {status}'
+                    for name, status in unexpected.items()))
+
+    def print_table(self, results, previous):
+        header = ['view'] + list(COLUMNS)
+        if previous:
+            header.append('p95_diff')
+        rows = []
+        for name, result in results.items():
+            row = [name] + [str(result[column]) for column in COLUMNS]
+            if previous:
+                before = previous.get(name)
+                row.append(
+                    f'{(result["p95_ms"] / before["p95_ms"] - 1) * 100:+.0f}%'
+                    if before and before['p95_ms'] else '-')
+            rows.append(row)
+        widths = [max(len(row[index]) for row in [header] + rows)
+                  for index in range(len(header))]
+        for row in [header] + rows:
+            self.stdout.write('  '.join(
+                value.ljust(width) for value, width in zip(row, widths)))
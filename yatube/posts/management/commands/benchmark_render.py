@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Замеряет рендеринг постов ленты без базы: медиана '
+            'микросекунд на пост без кэша шаблонов, с кэшем и с '
+            'подготовленными prepare_posts() адресами и датами.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=10,
+                            help='Постов на странице.')
+        parser.add_argument('--repeats', type=int, default=200,
+                            help='Сколько раз рендерить страницу.')
+
+    def handle(self, *args, **options):
+        results = benchmark.render_feed(options['posts'],
+                                        options['repeats'])
+        for name, per_post in results.items():
+            self.stdout.write(f'{name:<16} {per_post:>8.1f} мкс на пост')
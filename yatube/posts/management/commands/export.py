@@ -0,0 +1,130 @@
+import csv
+import gzip
+import io
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+
+from posts.models import Comment, Follow, Post
+
+# Модель, выгружаемые столбцы и поле даты для --since.
+EXPORTS = {
+    'posts': (Post, ('id', 'text', 'pub_date', 'author_id', 'group_id',
+                     'image', 'comments_count'), 'pub_date'),
+    'comments': (Comment, ('id', 'post_id', 'author_id', 'text', 'created'),
+                 'created'),
+    'follows': (Follow, ('id', 'user_id', 'author_id'), None),
+}
+
+
+def chunked_rows(queryset, columns, last_pk, chunk_size):
+    """Строки по возрастанию pk пачками, без OFFSET и без всей таблицы
+    в памяти."""
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list(*columns)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last_pk = rows[-1][0]
+
+
+def encode_ndjson(columns, rows, header):
+    return ''.join(
+        json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder,
+                   ensure_ascii=False) + '\n'
+        for row in rows
+    ).encode()
+
+
+def encode_csv(columns, rows, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    writer.writerows(
+        [value.isoformat() if hasattr(value, 'isoformat') else value
+         for value in row]
+        for row in rows
+    )
+    return buffer.getvalue().encode()
+
+
+ENCODERS = {'ndjson': encode_ndjson, 'csv': encode_csv}
+
+
+class Command(BaseCommand):
+    help = ('Потоково выгружает посты, комментарии или подписки в NDJSON '
+            'или CSV. После каждой пачки рядом с файлом сохраняется '
+            'контрольная точка: --resume продолжает прерванную выгрузку, '
+            'а после завершённой дописывает только новые строки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(EXPORTS))
+        parser.add_argument('output', help='Файл выгрузки.')
+        parser.add_argument('--format', choices=sorted(ENCODERS),
+                            default='ndjson')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Сжимать каждую пачку отдельным gzip-членом.')
+        parser.add_argument('--since-id', type=int, default=0,
+                            help='Только строки с id больше этого.')
+        parser.add_argument('--since',
+                            help='Только строки с датой не раньше этой '
+                                 '(ISO 8601), для постов и комментариев.')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Сколько строк читать и писать за раз.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Продолжить с контрольной точки.')
+
+    def handle(self, *args, **options):
+        model, columns, date_field = EXPORTS[options['model']]
+        queryset = model.objects.all()
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if date_field is None or since is None:
+                raise CommandError('--since не подходит для этой выгрузки')
+            queryset = queryset.filter(**{f'{date_field}__gte': since})
+        output = options['output']
+        state_path = f'{output}.state'
+        state = {key: options[key] for key in
+                 ('model', 'format', 'gzip', 'since', 'since_id')}
+        last_pk, offset, total = options['since_id'], 0, 0
+        if options['resume'] and os.path.exists(state_path):
+            with open(state_path) as file:
+                saved = json.load(file)
+            if {key: saved[key] for key in state} != state:
+                raise CommandError('Параметры не совпадают с контрольной '
+                                   'точкой')
+            last_pk, offset, total = (saved['last_id'], saved['offset'],
+                                      saved['rows'])
+        encode = ENCODERS[options['format']]
+        with open(output, 'r+b' if offset else 'wb') as file:
+            # Всё, что записано после контрольной точки, — недописанная
+            # пачка упавшего запуска.
+            file.truncate(offset)
+            file.seek(offset)
+            for rows in chunked_rows(queryset, columns, last_pk,
+                                     options['chunk_size']):
+                data = encode(columns, rows, header=not file.tell())
+                if options['gzip']:
+                    data = gzip.compress(data)
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+                last_pk, total = rows[-1][0], total + len(rows)
+                self._save_state(state_path, dict(
+                    state, last_id=last_pk, offset=file.tell(), rows=total))
+        self._save_state(state_path, dict(
+            state, last_id=last_pk, offset=os.path.getsize(output),
+            rows=total))
+        self.stdout.write(f'Выгружено строк: {total}, последний id: '
+                          f'{last_pk}')
+
+    def _save_state(self, path, state):
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(state, file)
+        os.replace(temporary, path)
@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import generate_in_worker, generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = ('Создаёт варианты картинок существующих постов для srcset '
+            'и отмечает их ширины у постов. Каждая картинка '
+            'обрабатывается один раз, даже если она у нескольких постов; '
+            'уже готовые пропускаются без --force.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=settings.THUMBNAIL_WORKERS,
+                            help='Число потоков; 0 — в текущем потоке.')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Сколько картинок ставить в пул за раз.')
+        parser.add_argument('--force', action='store_true',
+                            help='Пересоздать и уже готовые варианты.')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='')
+        if not options['force']:
+            posts = posts.exclude(image__in=Post.objects.exclude(
+                image_widths='').values('image'))
+        names = (posts.order_by('image').values_list('image', flat=True)
+                 .distinct().iterator(chunk_size=options['chunk_size']))
+        total = 0
+        if not options['workers']:
+            for name in names:
+                generate_thumbnails(name)
+                total += 1
+        else:
+            with ThreadPoolExecutor(options['workers']) as executor:
+                chunk = []
+                for name in names:
+                    chunk.append(name)
+                    if len(chunk) == options['chunk_size']:
+                        total += len(list(executor.map(generate_in_worker,
+                                                       chunk)))
+                        chunk = []
+                total += len(list(executor.map(generate_in_worker, chunk)))
+        self.stdout.write(f'Обработано картинок: {total}')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает полнотекстовый индекс постов, например после '
+            'массовой загрузки в обход сигналов.')
+
+    def handle(self, *args, **options):
+        search.rebuild_index()
+        self.stdout.write('Поисковый индекс пересобран')
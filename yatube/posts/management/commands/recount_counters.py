@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts import counters
+from posts.models import Post
+
+User = get_user_model()
+
+
+def chunked_ids(queryset, chunk_size):
+    last_pk = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last_pk).order_by('pk')
+                   .values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        last_pk = ids[-1]
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает денормализованные счётчики постов, подписок '
+            'и комментариев, если они разошлись с данными.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Сколько строк пересчитывать за раз.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        users = posts = 0
+        for ids in chunked_ids(User.objects.all(), chunk_size):
+            counters.recount_users(ids)
+            users += len(ids)
+        for ids in chunked_ids(Post.objects.all(), chunk_size):
+            counters.recount_posts(ids)
+            posts += len(ids)
+        self.stdout.write(
+            f'Пересчитано пользователей: {users}, постов: {posts}')
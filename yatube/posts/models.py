@@ -1,9 +1,66 @@
 from django.db import models
+from django.db.models.query import ModelIterable
 from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import formats
+from django.utils.functional import cached_property
+from django.utils.timezone import template_localtime
+
+from core.storage import ContentAddressedStorage
 
 User = get_user_model()
 
 NUMBER_OF_CHARACTERS = 15
+PUB_DATE_FORMAT = 'd E Y'
+
+
+def prepare_posts(posts):
+    """Заранее заполняет адреса и дату, которые выводит one_post.html.
+
+    Адрес профиля и группы и дата считаются по разу на автора, группу и
+    день, а адрес поста собирается из одного reverse() на страницу.
+    """
+    head, tail = reverse('posts:post_detail', args=[0]).rsplit('0', 1)
+    known = {}
+
+    def once(key, compute):
+        if key not in known:
+            known[key] = compute()
+        return known[key]
+
+    for post in posts:
+        values = post.__dict__
+        values['detail_url'] = f'{head}{post.pk}{tail}'
+        values['author_url'] = once(('author', post.author_id),
+                                    lambda: post.author_url)
+        values['group_url'] = once(('group', post.group_id),
+                                   lambda: post.group_url)
+        day = template_localtime(post.pub_date).date()
+        values['pub_date_display'] = once(('day', day),
+                                          lambda: post.pub_date_display)
+    return posts
+
+
+class PostQuerySet(models.QuerySet):
+    _for_display = False
+
+    def for_display(self):
+        """Посты для ленты: prepare_posts() при вычислении запроса."""
+        clone = self._chain()
+        clone._for_display = True
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._for_display = self._for_display
+        return clone
+
+    def _fetch_all(self):
+        prepare = (self._result_cache is None and self._for_display
+                   and self._iterable_class is ModelIterable)
+        super()._fetch_all()
+        if prepare:
+            prepare_posts(self._result_cache)
 
 
 class Post(models.Model):
@@ -25,15 +82,62 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
+    comments_count = models.PositiveIntegerField(
+        'Количество комментариев', default=0, editable=False)
+    image_widths = models.CharField(
+        'Ширины вариантов картинки', max_length=100, blank=True,
+        default='', editable=False)
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки', null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(
+        'Высота картинки', null=True, blank=True, editable=False)
+    image_placeholder = models.TextField(
+        'Заглушка картинки', blank=True, default='', editable=False,
+        help_text='Размытое превью в data: URI')
+
+    objects = PostQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.text[:NUMBER_OF_CHARACTERS]
 
+    @property
+    def image_variant_widths(self):
+        """Ширины готовых вариантов картинки (posts/images.py)."""
+        return [int(width) for width in self.image_widths.split(',')
+                if width]
+
+    @cached_property
+    def detail_url(self):
+        return reverse('posts:post_detail', args=[self.pk])
+
+    @cached_property
+    def author_url(self):
+        return reverse('posts:profile', args=[self.author.username])
+
+    @cached_property
+    def group_url(self):
+        if self.group_id is None:
+            return None
+        return reverse('posts:group_list', args=[self.group.slug])
+
+    @cached_property
+    def pub_date_display(self):
+        return formats.date_format(template_localtime(self.pub_date),
+                                   PUB_DATE_FORMAT)
+
     class Meta:
         default_related_name = 'posts'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['pub_date'], name='post_pub_date_idx'),
+            models.Index(fields=['author', 'pub_date'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', 'pub_date'],
+                         name='post_group_pub_date_idx'),
+        ]
 
 
 class Group(models.Model):
@@ -61,6 +165,13 @@ class Comment(models.Model):
     def __str__(self):
         return self.text
 
+    class Meta:
+        ordering = ['created']
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created_idx'),
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -75,3 +186,47 @@ class Follow(models.Model):
 
     def __str__(self):
         return self.user, self.author
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'],
+                                    name='unique_follow'),
+        ]
+
+
+class UserCounters(models.Model):
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='counters')
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0,
+                                                  db_index=True)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline')
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries')
+    pub_date = models.DateTimeField('Дата публикации поста')
+
+    def __str__(self):
+        return f'{self.user_id}: {self.post_id}'
+
+    class Meta:
+        ordering = ['-pub_date', '-post_id']
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', 'pub_date', 'post'],
+                         name='timeline_user_feed_idx'),
+        ]
@@ -0,0 +1,149 @@
+import base64
+import binascii
+import json
+from collections.abc import Sequence
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+CURSOR_ORDERING = ('-pub_date', '-pk')
+
+
+class CountedPaginator(Paginator):
+    """Paginator с заранее известным числом объектов вместо COUNT(*)."""
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+    @cached_property
+    def count(self):
+        return self._count
+
+
+class CursorPage(Sequence):
+    """Страница курсорной пагинации: без номера и общего количества."""
+
+    def __init__(self, object_list, paginator, next_cursor=None,
+                 previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.is_cursor = True
+
+    def __repr__(self):
+        return f'<CursorPage {self.next_cursor or "last"}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Keyset-пагинация по упорядоченным полям без COUNT и OFFSET.
+
+    Курсор непрозрачен для клиента: это base64 от направления и значений
+    полей сортировки у крайней записи страницы.
+    """
+
+    def __init__(self, queryset, per_page, ordering=CURSOR_ORDERING):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = tuple(
+            self._get_field(name.lstrip('-')) for name in self.ordering
+        )
+
+    def _get_field(self, name):
+        opts = self.queryset.model._meta
+        return opts.pk if name == 'pk' else opts.get_field(name)
+
+    def encode_cursor(self, obj, direction):
+        values = [field.value_to_string(obj) for field in self.fields]
+        raw = json.dumps([direction, values]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Возвращает (направление, значения) или None для кривого курсора."""
+        if not cursor:
+            return None
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            raw = base64.urlsafe_b64decode(cursor + padding)
+            direction, values = json.loads(raw.decode())
+            if direction not in ('next', 'prev'):
+                return None
+            if len(values) != len(self.fields):
+                return None
+            values = [
+                field.to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except (binascii.Error, UnicodeDecodeError, ValueError,
+                TypeError, ValidationError):
+            return None
+        return direction, values
+
+    def _keyset_filter(self, values, reverse):
+        query = Q()
+        for index, name in enumerate(self.ordering):
+            descending = name.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            condition = Q(**{f'{name.lstrip("-")}__{lookup}': values[index]})
+            for previous, value in zip(self.ordering[:index], values):
+                condition &= Q(**{previous.lstrip('-'): value})
+            query |= condition
+        # Избыточная нестрогая граница по первому полю даёт планировщику
+        # диапазон по индексу вместо перебора веток OR.
+        first = self.ordering[0]
+        lookup = 'lte' if first.startswith('-') != reverse else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{lookup}': values[0]}) & query
+
+    def _reversed_ordering(self):
+        return tuple(
+            name[1:] if name.startswith('-') else f'-{name}'
+            for name in self.ordering
+        )
+
+    def get_page(self, cursor=None):
+        decoded = self.decode_cursor(cursor)
+        queryset = self.queryset
+        if decoded is None:
+            direction, values = 'next', None
+        else:
+            direction, values = decoded
+        reverse = direction == 'prev'
+        if values is not None:
+            queryset = queryset.filter(self._keyset_filter(values, reverse))
+        if reverse:
+            queryset = queryset.order_by(*self._reversed_ordering())
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        object_list = list(queryset[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if reverse:
+            object_list.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+        next_cursor = previous_cursor = None
+        if object_list and has_next:
+            next_cursor = self.encode_cursor(object_list[-1], 'next')
+        if object_list and has_previous:
+            previous_cursor = self.encode_cursor(object_list[0], 'prev')
+        return CursorPage(object_list, self, next_cursor, previous_cursor)
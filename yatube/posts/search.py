@@ -0,0 +1,92 @@
+"""Полнотекстовый поиск по постам на SQLite FTS5.
+
+Индекс — отдельная таблица FTS5 с копией текста поста, её обновляют
+сигналы сохранения и удаления Post. Триггеры в базе не подошли бы:
+Django пересоздаёт таблицу SQLite при изменении полей, и триггеры молча
+пропали бы. Токенизатор unicode61 приводит кириллицу к нижнему регистру,
+ё заменяется на е при индексации и в запросе, слова запроса ищутся по
+префиксу, поэтому «кот» находит «котами». На других СУБД поиск
+деградирует до icontains.
+"""
+import re
+
+from django.db import connection
+
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+TOKEN = re.compile(r'\w+')
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def normalize(text):
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def build_match(query):
+    """Запрос FTS5: все слова, каждое по префиксу, без операторов FTS."""
+    tokens = TOKEN.findall(normalize(query))
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def index_post(post):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, text)'
+                       ' VALUES (%s, %s)', [post.pk, normalize(post.text)])
+
+
+def unindex_post(post_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                       [post_id])
+
+
+INDEX_POSTS_SQL = (
+    f'INSERT INTO {FTS_TABLE} (rowid, text)'
+    " SELECT id, replace(replace(text, 'ё', 'е'), 'Ё', 'Е') FROM posts_post"
+)
+
+
+def index_posts_between(first_id, last_id):
+    """Индексирует посты с id в диапазоне, вставленные bulk_create."""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'{INDEX_POSTS_SQL} WHERE id BETWEEN %s AND %s',
+                       [first_id, last_id])
+
+
+def rebuild_index():
+    """Заново индексирует все посты."""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(INDEX_POSTS_SQL)
+
+
+def search_posts(query, queryset=None):
+    """Посты по запросу, самые релевантные (bm25) первыми."""
+    if queryset is None:
+        queryset = Post.objects.all()
+    match = build_match(query)
+    if not match:
+        return queryset.none()
+    if not is_available():
+        return queryset.filter(text__icontains=query.strip())
+    table = Post._meta.db_table
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = {table}.id', f'{FTS_TABLE} MATCH %s'],
+        params=[match],
+        select={'rank': f'bm25({FTS_TABLE})'},
+        order_by=['rank', '-pub_date'],
+    )
@@ -0,0 +1,130 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counters, feed_cache, images, search, thumbnails, timeline
+from .models import Comment, Follow, Post, User, UserCounters
+
+# Счётчики подключены раньше ленты: решение о fan-out читает followers_count.
+
+
+@receiver(post_save, sender=User)
+def create_user_counters(sender, instance, created, **kwargs):
+    if created:
+        UserCounters.objects.get_or_create(user=instance)
+
+
+@receiver(pre_save, sender=Post)
+def fill_image_metadata(sender, instance, **kwargs):
+    """Размеры и заглушка новой картинки, пока она ещё в памяти."""
+    if not instance.image:
+        metadata = {'image_width': None, 'image_height': None,
+                    'image_placeholder': ''}
+    elif not instance.image._committed:
+        metadata = images.image_metadata(instance.image)
+    else:
+        return
+    for name, value in metadata.items():
+        setattr(instance, name, value)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_counters(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.change_user_counters(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.change_comments_count(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.change_comments_count(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_counters(instance.user_id, following_count=1)
+        counters.change_user_counters(instance.author_id, followers_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.change_user_counters(instance.user_id, following_count=-1)
+    counters.change_user_counters(instance.author_id, followers_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out_post(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        timeline.backfill_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def clean_timeline(sender, instance, **kwargs):
+    timeline.remove_author(instance.user_id, instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def remember_group(sender, instance, **kwargs):
+    """Группа до правки: её страница тоже теряет пост."""
+    instance._previous_group_id = None
+    if not instance._state.adding:
+        instance._previous_group_id = (
+            Post.objects.filter(pk=instance.pk)
+            .values_list('group_id', flat=True).first())
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_feeds(sender, instance, **kwargs):
+    scopes = [feed_cache.POSTS_SCOPE, *feed_cache.post_scopes(instance)]
+    previous = getattr(instance, '_previous_group_id', None)
+    if previous not in (None, instance.group_id):
+        scopes.append(feed_cache.group_scope(previous))
+    for scope in scopes:
+        feed_cache.bump_generation(scope)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_post_page(sender, instance, **kwargs):
+    feed_cache.bump_generation(feed_cache.post_scope(instance.post_id))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_feed(sender, instance, **kwargs):
+    feed_cache.bump_generation(feed_cache.follow_scope(instance.user_id))
+    # Число подписчиков в профиле автора.
+    feed_cache.bump_generation(feed_cache.author_scope(instance.author_id))
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.unindex_post(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def release_post_image(sender, instance, **kwargs):
+    thumbnails.release_on_commit(instance.image.name,
+                                 instance.image_variant_widths)
@@ -0,0 +1,61 @@
+from django import template
+from django.conf import settings
+from django.utils.html import format_html, format_html_join
+from sorl.thumbnail import get_thumbnail
+
+from ..images import frame_size, srcsets, variant_name, variant_widths
+from ..thumbnails import FALLBACK_GEOMETRY
+
+register = template.Library()
+
+# Ширина картинки в колонке ленты на сетке Bootstrap 5.
+SIZES = ('(max-width: 576px) 100vw, (max-width: 768px) 516px, '
+         '(max-width: 992px) 696px, 936px')
+# h-auto: высоту задают width и height, а не атрибут height.
+CSS_CLASS = 'card-img h-auto my-2'
+
+
+def placeholder_style(post):
+    if not post.image_placeholder:
+        return ''
+    return format_html(' style="background: url({}) center / cover"',
+                       post.image_placeholder)
+
+
+@register.simple_tag
+def post_image(post, sizes=SIZES, css_class=CSS_CLASS):
+    """<picture> с вариантами картинки поста: WebP в <source>, JPEG
+    в <img>.
+
+    width и height кадра держат место под картинку, пока она лениво
+    грузится, а до тех пор видна заглушка из Post.image_placeholder.
+    Адреса вариантов считаются по image_width без обращения к файлам:
+    недостающие создаст view image_variant.
+    """
+    if not post.image:
+        return ''
+    widths = post.image_variant_widths
+    if not widths and settings.THUMBNAIL_ON_DEMAND and post.image_width:
+        widths = variant_widths(post.image_width)
+    if not widths:
+        geometry, options = FALLBACK_GEOMETRY
+        thumbnail = get_thumbnail(post.image, geometry, **options)
+        # Кадр с crop и upscale всегда ровно по геометрии.
+        width, height = geometry.split('x')
+        return format_html(
+            '<img class="{}" src="{}" width="{}" height="{}"{}'
+            ' loading="lazy" alt="">',
+            css_class, thumbnail.url, width, height,
+            placeholder_style(post))
+    *preferred, (_, fallback) = srcsets(post.image.name, widths)
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((mime, srcset, sizes) for mime, srcset in preferred))
+    width, height = frame_size(widths[-1])
+    return format_html(
+        '<picture>{}<img class="{}" src="{}" srcset="{}" sizes="{}"'
+        ' width="{}" height="{}"{} loading="lazy" alt=""></picture>',
+        sources, css_class,
+        post.image.storage.url(variant_name(post.image.name, widths[-1],
+                                            'jpg')),
+        fallback, sizes, width, height, placeholder_style(post))
@@ -0,0 +1,110 @@
+import json
+from http import HTTPStatus
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Follow, Group, Post
+from ..timeline import CELEBRITIES_CACHE_KEY
+
+User = get_user_model()
+NUMBER_OF_POSTS = 13
+POSTS_ON_THE_FIRST_PAGE = 10
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Тестовая группа',
+                                         slug='test-group',
+                                         description='Тестовое описание')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for number in range(NUMBER_OF_POSTS):
+            Post.objects.create(author=cls.author, group=cls.group,
+                                text=f'Тестовый пост №{number}')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def get_json(self, url, data=None):
+        response = self.client.get(url, data)
+        self.assertTrue(response.streaming)
+        return response, json.loads(b''.join(response.streaming_content))
+
+    def test_feeds_paginate_with_cursor(self):
+        """Все ленты отдают посты от новых к старым с курсором."""
+        urls = (
+            reverse('posts:api_index'),
+            reverse('posts:api_group_list', kwargs={'slug': 'test-group'}),
+            reverse('posts:api_profile', kwargs={'username': 'author'}),
+            reverse('posts:api_follow_index'),
+        )
+        expected = list(Post.objects.order_by('-pub_date', '-pk')
+                        .values_list('pk', flat=True))
+        for url in urls:
+            with self.subTest(url=url):
+                _, first = self.get_json(url)
+                self.assertEqual(len(first['results']),
+                                 POSTS_ON_THE_FIRST_PAGE)
+                self.assertEqual(first['results'][0]['author'], 'author')
+                self.assertEqual(first['results'][0]['group'], 'test-group')
+                _, second = self.get_json(url, {'cursor': first['next']})
+                ids = [post['id']
+                       for post in first['results'] + second['results']]
+                self.assertEqual(ids, expected)
+                self.assertIsNone(second['next'])
+
+    def test_fields_limit_loaded_columns(self):
+        """?fields= отдаёт только выбранные поля и не читает лишнее."""
+        feeds = (
+            ('posts:api_index', 1, 1),
+            ('posts:api_follow_index', 1, 1),
+            # Автор без fan-out: записи ленты и поток его постов.
+            ('posts:api_follow_index', 0, 2),
+        )
+        for name, fanout_limit, queries in feeds:
+            cache.delete(CELEBRITIES_CACHE_KEY)
+            with self.subTest(url=name, fanout_limit=fanout_limit), \
+                    self.settings(TIMELINE_FANOUT_LIMIT=fanout_limit), \
+                    CaptureQueriesContext(connection) as context:
+                _, data = self.get_json(reverse(name),
+                                        {'fields': 'id,author'})
+                self.assertEqual(set(data['results'][0]), {'id', 'author'})
+                self.assertEqual(len(data['results']),
+                                 POSTS_ON_THE_FIRST_PAGE)
+                feed_queries = [
+                    query['sql'] for query in context.captured_queries
+                    if 'FROM "posts_post"' in query['sql']
+                    or 'FROM "posts_timelineentry"' in query['sql']]
+                # Курсор не дочитывает отложенные поля по записи.
+                self.assertEqual(len(feed_queries), queries)
+                sql = ' '.join(feed_queries)
+                self.assertNotIn('"text"', sql)
+                self.assertNotIn('posts_group', sql)
+
+    def test_following_state_in_bulk(self):
+        """Поле following — подписан ли читатель на автора поста."""
+        _, data = self.get_json(reverse('posts:api_index'),
+                                {'fields': 'id,following'})
+        self.assertTrue(all(post['following'] for post in data['results']))
+        response = Client().get(reverse('posts:api_index'),
+                                {'fields': 'following'})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertFalse(any(post['following'] for post in data['results']))
+
+    def test_errors(self):
+        response = self.client.get(reverse('posts:api_index'),
+                                   {'fields': 'id,password'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        response = self.client.get(
+            reverse('posts:api_group_list', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        response = Client().get(reverse('posts:api_follow_index'))
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
@@ -0,0 +1,208 @@
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from .. import benchmark, urls
+from ..management.commands import export
+from ..models import Comment, Follow, Group, Post, TimelineEntry
+from ..search import search_posts
+from .tests_forms import SMALL_GIF
+
+User = get_user_model()
+NUMBER_OF_POSTS = 5
+
+
+class ExportCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.posts = [
+            Post.objects.create(author=cls.author, text=f'Пост №{number}')
+            for number in range(NUMBER_OF_POSTS)
+        ]
+        Comment.objects.create(post=cls.posts[0], author=cls.reader,
+                               text='Комментарий, с "кавычками"')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'export')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def export(self, *args):
+        call_command('export', *args, stdout=io.StringIO())
+
+    def read_ndjson(self):
+        with gzip.open(self.output, 'rt') as file:
+            return [json.loads(line) for line in file]
+
+    def test_export_ndjson_gzip_in_chunks(self):
+        self.export('posts', self.output, '--gzip', '--chunk-size', '2')
+        rows = self.read_ndjson()
+        self.assertEqual([row['id'] for row in rows],
+                         [post.pk for post in self.posts])
+        self.assertEqual(rows[0]['text'], 'Пост №0')
+        self.assertEqual(rows[0]['author_id'], self.author.pk)
+
+    def test_export_csv(self):
+        self.export('comments', self.output, '--format', 'csv')
+        with open(self.output, newline='') as file:
+            rows = list(csv.reader(file))
+        self.assertEqual(rows[0], ['id', 'post_id', 'author_id', 'text',
+                                   'created'])
+        self.assertEqual(rows[1][3], 'Комментарий, с "кавычками"')
+        self.export('follows', self.output, '--format', 'csv')
+        with open(self.output, newline='') as file:
+            self.assertEqual(len(list(csv.reader(file))), 2)
+
+    def test_incremental_export(self):
+        self.export('posts', self.output, '--gzip',
+                    '--since-id', str(self.posts[1].pk))
+        self.assertEqual([row['id'] for row in self.read_ndjson()],
+                         [post.pk for post in self.posts[2:]])
+
+    def test_resume_after_crash(self):
+        """--resume отрезает недописанную пачку, продолжает с контрольной
+        точки, а после завершения дописывает только новые строки."""
+        original = export.chunked_rows
+
+        def crash_after_first_chunk(*args):
+            rows = original(*args)
+            yield next(rows)
+            raise RuntimeError('Упали посреди выгрузки')
+
+        with mock.patch.object(export, 'chunked_rows',
+                               crash_after_first_chunk):
+            with self.assertRaises(RuntimeError):
+                self.export('posts', self.output, '--gzip',
+                            '--chunk-size', '2')
+        with open(self.output, 'ab') as file:
+            file.write(b'\x1f\x8b partial chunk')
+        self.export('posts', self.output, '--gzip', '--chunk-size', '2',
+                    '--resume')
+        new_post = Post.objects.create(author=self.author, text='Новый пост')
+        self.export('posts', self.output, '--gzip', '--chunk-size', '2',
+                    '--resume')
+        self.assertEqual([row['id'] for row in self.read_ndjson()],
+                         [post.pk for post in self.posts + [new_post]])
+
+
+class ImportCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Тестовая группа',
+                                         slug='test-group',
+                                         description='Тестовое описание')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.media = os.path.join(self.directory, 'media')
+        with open(os.path.join(self.directory, 'small.gif'), 'wb') as file:
+            file.write(SMALL_GIF)
+        with open(os.path.join(self.directory, 'broken.gif'), 'wb') as file:
+            file.write(b'not an image')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def import_records(self, records):
+        path = os.path.join(self.directory, 'import.ndjson')
+        with open(path, 'w') as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        stdout = io.StringIO()
+        with override_settings(MEDIA_ROOT=self.media):
+            call_command('import_posts', path, '--images-dir',
+                         self.directory, '--batch-size', '2',
+                         stdout=stdout)
+        return stdout.getvalue()
+
+    def test_import_posts_and_comments(self):
+        output = self.import_records([
+            {'id': 'a', 'author': 'author', 'group': 'test-group',
+             'text': 'Перенесённый пост', 'pub_date': '2020-01-02T03:04:05',
+             'image': 'small.gif'},
+            {'id': 'b', 'author': 'author', 'text': 'Битая картинка',
+             'image': 'broken.gif'},
+            {'id': 'c', 'author': 'nobody', 'text': 'Неизвестный автор'},
+            {'type': 'comment', 'post': 'a', 'author': 'reader',
+             'text': 'Комментарий', 'created': '2020-01-03T00:00:00'},
+        ])
+        self.assertIn('Постов: 2, комментариев: 1, пропущено: 1', output)
+        self.assertIn('строк/с', output)
+        post = Post.objects.get(text='Перенесённый пост')
+        self.assertEqual(post.pub_date.year, 2020)
+        self.assertEqual(post.group, self.group)
+        self.assertTrue(post.image.name.endswith('.gif'))
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.media, post.image.name)))
+        self.assertFalse(Post.objects.get(text='Битая картинка').image)
+        self.assertEqual(post.comments.get().created.year, 2020)
+        # Всё, что обычно делают сигналы, досчитано после загрузки.
+        self.assertEqual(post.comments_count, 1)
+        self.author.counters.refresh_from_db()
+        self.assertEqual(self.author.counters.posts_count, 2)
+        self.assertEqual(list(search_posts('перенесенный')), [post])
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 2)
+
+
+class GenerateThumbnailsCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author')
+        for image, widths in (('posts/shared.gif', ''),
+                              ('posts/shared.gif', ''),
+                              ('posts/done.gif', '2')):
+            Post.objects.create(author=author, text='Пост', image=image,
+                                image_widths=widths)
+
+    def generated(self, *args):
+        with mock.patch('posts.management.commands.generate_thumbnails.'
+                        'generate_thumbnails') as generate:
+            call_command('generate_thumbnails', '--workers', '0', *args,
+                         stdout=io.StringIO())
+        return [call.args[0] for call in generate.call_args_list]
+
+    def test_each_image_generated_once(self):
+        self.assertEqual(self.generated(), ['posts/shared.gif'])
+        self.assertEqual(self.generated('--force'),
+                         ['posts/done.gif', 'posts/shared.gif'])
+
+
+class BenchmarkTests(TestCase):
+    def test_benchmark_covers_every_url(self):
+        context = benchmark.seed({'users': 5, 'groups': 2, 'posts': 20,
+                                  'comments': 10, 'follows': 6})
+        results = benchmark.run(context, requests=2)
+        self.assertEqual(set(results),
+                         {pattern.name for pattern in urls.urlpatterns})
+        self.assertEqual(benchmark.unexpected_statuses(results), {})
+        for name, result in results.items():
+            with self.subTest(name=name):
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+                self.assertGreater(result['queries'], 0)
+
+    def test_render_benchmark(self):
+        results = benchmark.render_feed(count=3, repeats=2)
+        self.assertEqual(set(results),
+                         {'uncached', 'cached', 'cached_prepared'})
+        out = io.StringIO()
+        call_command('benchmark_render', posts=3, repeats=2, stdout=out)
+        self.assertIn('cached_prepared', out.getvalue())
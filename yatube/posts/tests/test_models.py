@@ -1,7 +1,12 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.template import Context, Template
 from django.test import TestCase
+from django.urls import reverse
 
-from ..models import Group, Post
+from ..models import Comment, Follow, Group, Post, UserCounters
 
 User = get_user_model()
 NUMBER_OF_CHARACTERS = 15
@@ -56,3 +61,73 @@ class PostModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     post._meta.get_field(field).help_text, expected_value)
+
+    def test_for_display_matches_template_tags(self):
+        """Подготовленные адреса и дата совпадают с тегами шаблона."""
+        group = Group.objects.create(title='Группа', slug='group')
+        Post.objects.create(author=PostModelTest.user, text='В группе',
+                            group=group)
+        expected = Template(
+            '{% for post in posts %}'
+            "{% url 'posts:post_detail' post.pk %} "
+            "{% url 'posts:profile' post.author %} "
+            "{% if post.group %}{% url 'posts:group_list' post.group.slug %}"
+            '{% endif %} {{ post.pub_date|date:"d E Y" }};{% endfor %}'
+        ).render(Context({'posts': Post.objects.all()}))
+        posts = Post.objects.select_related('author', 'group').for_display()
+        with self.assertNumQueries(1):
+            prepared = ''.join(
+                f'{post.detail_url} {post.author_url} '
+                f'{post.group_url or ""} {post.pub_date_display};'
+                for post in posts)
+        self.assertEqual(prepared, expected)
+        self.assertEqual(PostModelTest.post.detail_url,
+                         reverse('posts:post_detail',
+                                 args=[PostModelTest.post.pk]))
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.author = User.objects.create_user(username='author')
+
+    def test_counters_follow_signals(self):
+        """Счётчики меняются при создании и удалении постов,
+        комментариев и подписок."""
+        post = Post.objects.create(author=self.author, text='Тестовый пост')
+        comment = Comment.objects.create(post=post, author=self.user,
+                                         text='Комментарий')
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(
+            UserCounters.objects.get(user=self.author).posts_count, 1)
+        self.assertEqual(
+            UserCounters.objects.get(user=self.author).followers_count, 1)
+        self.assertEqual(
+            UserCounters.objects.get(user=self.user).following_count, 1)
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(
+            UserCounters.objects.get(user=self.author).followers_count, 0)
+        self.assertEqual(
+            UserCounters.objects.get(user=self.user).following_count, 0)
+
+    def test_recount_counters_command(self):
+        """recount_counters чинит разошедшиеся счётчики."""
+        post = Post.objects.create(author=self.author, text='Тестовый пост')
+        Comment.objects.create(post=post, author=self.user,
+                               text='Комментарий')
+        UserCounters.objects.update(posts_count=42)
+        UserCounters.objects.filter(user=self.user).delete()
+        Post.objects.update(comments_count=0)
+        call_command('recount_counters', chunk_size=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(
+            UserCounters.objects.get(user=self.author).posts_count, 1)
+        self.assertEqual(
+            UserCounters.objects.get(user=self.user).posts_count, 0)
@@ -0,0 +1,111 @@
+import re
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.testing import QueryBudgetMixin
+
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+NUMBER_OF_POSTS = 15
+POSTS_TABLES = re.compile(r'"posts_\w+"')
+TABLE_SCAN = re.compile(r'^SCAN (TABLE )?\w+$')
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class PostsDataTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Тестовая группа',
+                                         slug='test-group',
+                                         description='Тестовое описание')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for number in range(NUMBER_OF_POSTS):
+            cls.post = Post.objects.create(author=cls.author,
+                                           group=cls.group,
+                                           text=f'Тестовый пост №{number}')
+            Comment.objects.create(post=cls.post, author=cls.reader,
+                                   text='Комментарий')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+        cache.clear()
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Планы запросов SQLite')
+class QueryPlanTests(PostsDataTestCase):
+    """Основные запросы страниц идут по индексам, без полного
+    сканирования таблицы и временной сортировки."""
+
+    def assert_plans_use_indexes(self, url, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, data)
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or not POSTS_TABLES.search(sql):
+                continue
+            plan = explain(sql)
+            with self.subTest(url=url, data=data, sql=sql):
+                self.assertFalse(
+                    [step for step in plan if 'TEMP B-TREE' in step], plan)
+                self.assertFalse(
+                    [step for step in plan if TABLE_SCAN.match(step)], plan)
+        return response
+
+    def test_views_use_indexes(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk}),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            self.assert_plans_use_indexes(url)
+            self.assert_plans_use_indexes(url, {'page': 2})
+            response = self.assert_plans_use_indexes(url, {'cursor': ''})
+            page_obj = response.context.get('page_obj')
+            if page_obj is not None and page_obj.has_next():
+                self.assert_plans_use_indexes(
+                    url, {'cursor': page_obj.next_cursor})
+
+
+class QueryBudgetTests(QueryBudgetMixin, PostsDataTestCase):
+    """Число запросов страницы не растёт с числом постов на ней."""
+
+    def test_views_fit_query_budgets(self):
+        group = {'slug': self.group.slug}
+        author = {'username': self.author.username}
+        post = {'post_id': self.post.pk}
+        budgets = (
+            ('posts:index', {}, 4),
+            ('posts:search', {}, 4),
+            ('posts:group_list', group, 6),
+            ('posts:profile', author, 6),
+            ('posts:post_detail', post, 6),
+            ('posts:post_comments', post, 4),
+            ('posts:follow_index', {}, 5),
+            ('posts:api_index', {}, 3),
+            ('posts:api_group_list', group, 4),
+            ('posts:api_profile', author, 4),
+            ('posts:api_follow_index', {}, 5),
+        )
+        for name, kwargs, budget in budgets:
+            url = reverse(name, kwargs=kwargs)
+            with self.subTest(url=url):
+                self.assertQueryBudget(url, budget, {'q': 'пост'})
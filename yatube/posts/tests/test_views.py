@@ -1,5 +1,8 @@
+import json
 import shutil
 import tempfile
+from datetime import timedelta
+from io import StringIO
 
 from django.contrib.auth import get_user_model
 from django.test import Client, override_settings, TestCase
@@ -8,10 +11,14 @@ from django.utils import timezone
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache import cache
+from django.core.management import call_command
 from http import HTTPStatus
 
+from core import jobs
+
+from ..follow_graph import get_following_ids
 from ..forms import PostForm
-from ..models import Follow, Group, Post
+from ..models import Comment, Follow, Group, Post, TimelineEntry
 
 User = get_user_model()
 TEST_OF_POST = 13
@@ -21,6 +28,8 @@ NUMBER_OF_POSTS = 1
 NUMBER_OF_PAGES = 0
 NUMBER_OF_FOLLOW = 1
 NUMBER_OF_FOLLOW_AFTER_UNFOLLOWING = 0
+COMMENTS_COUNT = 25
+COMMENTS_ON_THE_FIRST_PAGE = 20
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
@@ -63,6 +72,7 @@ class PostPagesTests(TestCase):
     def setUp(self):
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
+        cache.clear()
 
     def test_pages_uses_correct_template(self):
         """URL-адрес использует соответствующий шаблон."""
@@ -177,6 +187,35 @@ class PostPagesTests(TestCase):
                     self.assertEqual(len(response.context.get('page_obj')),
                                      count)
 
+    def test_cursor_paginator(self):
+        """Курсорная пагинация отдаёт страницы без пропусков и повторов
+        и возвращается назад по курсору предыдущей страницы."""
+        Post.objects.bulk_create(
+            Post(text=f'Тестовый текст №{number}', author=self.user)
+            for number in range(TEST_OF_POST)
+        )
+        url = reverse('posts:index')
+        first_page = self.authorized_client.get(
+            url, {'cursor': ''}).context['page_obj']
+        self.assertEqual(len(first_page), POSTS_ON_THE_FIRST_PAGE)
+        self.assertFalse(first_page.has_previous())
+        second_page = self.authorized_client.get(
+            url, {'cursor': first_page.next_cursor}).context['page_obj']
+        self.assertEqual(len(second_page), POSTS_ON_THE_SECOND_PAGE)
+        self.assertFalse(second_page.has_next())
+        seen = [post.pk for post in first_page] + [
+            post.pk for post in second_page]
+        self.assertEqual(seen, list(
+            Post.objects.order_by('-pub_date', '-pk')
+            .values_list('pk', flat=True)))
+        back_page = self.authorized_client.get(
+            url, {'cursor': second_page.previous_cursor}).context['page_obj']
+        self.assertEqual([post.pk for post in back_page],
+                         [post.pk for post in first_page])
+        broken_page = self.authorized_client.get(
+            url, {'cursor': 'не-курсор'}).context['page_obj']
+        self.assertEqual(len(broken_page), POSTS_ON_THE_FIRST_PAGE)
+
 
 class FollowTests(TestCase):
     @classmethod
@@ -191,6 +230,7 @@ class FollowTests(TestCase):
         self.authorized_client.force_login(self.user)
         self.authorized_client2 = Client()
         self.authorized_client2.force_login(self.user2)
+        cache.clear()
 
     def test_auth_user_can_follow_and_unfollow(self):
         """Авторизованный пользователь может подписываться и
@@ -231,12 +271,328 @@ class FollowTests(TestCase):
         posts_no_follow = respone_no_follower.context['page_obj']
         self.assertNotIn(post, posts_no_follow)
 
+    def test_timeline_fan_out_and_unfollow(self):
+        """Новый пост раскладывается в ленты подписчиков, старые посты
+        подтягиваются при подписке и убираются при отписке."""
+        old_post = Post.objects.create(author=self.author,
+                                       text='Старый пост')
+        Follow.objects.create(user=self.user, author=self.author)
+        new_post = Post.objects.create(author=self.author,
+                                       text='Новый пост')
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(user=self.user)
+                 .values_list('post', flat=True)),
+            [new_post.pk, old_post.pk])
+        self.authorized_client.get(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': self.author.username}))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user)
+                         .exists())
+
+    def test_profile_following_state_is_cached(self):
+        """Состояние подписки берётся из кэша и меняется вместе с ней."""
+        url = reverse('posts:profile',
+                      kwargs={'username': self.author.username})
+        self.assertFalse(
+            self.authorized_client.get(url).context['following'])
+        self.authorized_client.get(reverse(
+            'posts:profile_follow',
+            kwargs={'username': self.author.username}))
+        self.assertTrue(self.authorized_client.get(url).context['following'])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_following_ids(self.user.pk),
+                             {self.author.pk})
+        self.authorized_client.get(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': self.author.username}))
+        self.assertFalse(
+            self.authorized_client.get(url).context['following'])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_timeline_merges_celebrity_posts_on_read(self):
+        """Посты авторов с большим числом подписчиков не раскладываются,
+        а подмешиваются в ленту при чтении."""
+        cache.clear()
+        Follow.objects.create(user=self.user, author=self.author)
+        cache.clear()
+        post = Post.objects.create(author=self.author, text='Тестовый пост')
+        self.assertFalse(TimelineEntry.objects.exists())
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertIn(post, response.context['page_obj'])
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_merged_feed_pages_in_order_without_writes(self):
+        """Лента с подмешанными постами идёт в общем порядке во всех
+        режимах пагинации и ничего не пишет при чтении."""
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=self.user2, author=self.author)
+        Follow.objects.create(user=self.user, author=self.user2)
+        cache.clear()
+        for number in range(12):
+            Post.objects.create(
+                author=self.author if number % 2 else self.user2,
+                text=f'Пост {number}')
+        expected = list(Post.objects.order_by('-pub_date', '-pk'))
+        entries = TimelineEntry.objects.count()
+        url = reverse('posts:follow_index')
+        pages = [self.authorized_client.get(url).context['page_obj'],
+                 self.authorized_client.get(url, {'page': 2})
+                 .context['page_obj']]
+        self.assertEqual([post for page in pages for post in page],
+                         expected)
+        first = self.authorized_client.get(url, {'cursor': ''})
+        page = first.context['page_obj']
+        second = self.authorized_client.get(
+            url, {'cursor': page.next_cursor}).context['page_obj']
+        self.assertEqual(list(page) + list(second), expected)
+        response = self.authorized_client.get(
+            reverse('posts:api_follow_index'), {'fields': 'id'})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([item['id'] for item in data['results']],
+                         [post.pk for post in expected[:10]])
+        self.assertEqual(TimelineEntry.objects.count(), entries)
+
+    @override_settings(TIMELINE_SIZE=2)
+    def test_fan_out_trims_timelines_in_background(self):
+        """Ленты подписчиков обрезаются фоновой задачей, а не в запросе
+        публикации."""
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=self.user2, author=self.author)
+        for number in range(3):
+            Post.objects.create(author=self.author, text=f'Пост {number}')
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user)
+                         .count(), 3)
+        jobs.run_pending()
+        for user in (self.user, self.user2):
+            self.assertEqual(
+                list(TimelineEntry.objects.filter(user=user)
+                     .values_list('post', flat=True)),
+                list(Post.objects.order_by('-pub_date', '-pk')
+                     .values_list('pk', flat=True)[:2]))
+
     def test_cache_index_page(self):
         """ Проверка кэша страницы"""
+        Post.objects.create(author=self.author, text='Тестовый пост')
         old_content = self.authorized_client.get('/').content
-        Post.objects.all().delete()
+        Post.objects.update(text='Изменён в обход сигналов')
         new_content = self.authorized_client.get('/').content
         self.assertEqual(old_content, new_content)
         cache.clear()
         clear_content = self.authorized_client.get('/').content
         self.assertNotEqual(old_content, clear_content)
+
+    def test_cache_index_page_invalidated_by_posts(self):
+        """Создание и удаление поста сразу сбрасывает кэш главной."""
+        old_content = self.authorized_client.get('/').content
+        post = Post.objects.create(author=self.author,
+                                   text='Свежий пост')
+        new_content = self.authorized_client.get('/').content
+        self.assertNotEqual(old_content, new_content)
+        self.assertIn(post.text.encode(), new_content)
+        post.delete()
+        self.assertEqual(self.authorized_client.get('/').content,
+                         old_content)
+
+    def test_cache_follow_page_varies_on_user(self):
+        """Кэш ленты подписок не отдаёт чужую ленту и сбрасывается
+        при подписке."""
+        Post.objects.create(author=self.author, text='Пост автора')
+        Follow.objects.create(user=self.user, author=self.author)
+        url = reverse('posts:follow_index')
+        self.assertContains(self.authorized_client.get(url), 'Пост автора')
+        self.assertNotContains(self.authorized_client2.get(url),
+                               'Пост автора')
+        Follow.objects.create(user=self.user2, author=self.author)
+        self.assertContains(self.authorized_client2.get(url), 'Пост автора')
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Тестовая группа',
+                                         slug='test_group',
+                                         description='Тестовое описание')
+        cls.post = Post.objects.create(author=cls.author, group=cls.group,
+                                       text='Тестовый пост')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+        cache.clear()
+
+    def test_not_modified(self):
+        """Повторный запрос с валидаторами получает 304 без тела."""
+        urls = (
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+                self.assertEqual(response.content, b'')
+                response = self.client.get(
+                    url,
+                    HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+
+    def test_validators_change(self):
+        """Комментарий, правка поста и другой пользователь меняют ETag."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Комментарий')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Комментарий')
+        etag = response['ETag']
+        self.post.text = 'Исправленный пост'
+        self.post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Исправленный пост')
+        self.client.force_login(self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_post_validators_follow_author_post_count(self):
+        """Новый пост автора меняет число постов на странице старого."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        response = self.client.get(url)
+        Post.objects.create(author=self.author, text='Ещё пост')
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'],
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            response.context['post'].author.counters.posts_count, 2)
+
+    def test_validators_scoped_to_page(self):
+        """Чужой пост не сбрасывает валидаторы страницы, перенос — да."""
+        other_group = Group.objects.create(title='Другая группа',
+                                           slug='other_group')
+        other_author = User.objects.create_user(username='other')
+        old_post = Post.objects.create(author=other_author,
+                                       group=other_group, text='Старый')
+        urls = (
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        Post.objects.create(author=other_author, group=other_group,
+                            text='Чужой пост')
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+        # Старый пост не новее страниц групп, но меняет обе.
+        other_url = reverse('posts:group_list',
+                            kwargs={'slug': other_group.slug})
+        other_etag = self.client.get(other_url)['ETag']
+        old_post.group = self.group
+        old_post.save()
+        response = self.client.get(urls[0],
+                                   HTTP_IF_NONE_MATCH=etags[urls[0]])
+        self.assertContains(response, 'Старый')
+        response = self.client.get(other_url, HTTP_IF_NONE_MATCH=other_etag)
+        self.assertNotContains(response, 'Старый')
+
+
+class CommentsPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(author=cls.user, text='Тестовый пост')
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.user, text=f'Комментарий {i}')
+            for i in range(COMMENTS_COUNT)
+        )
+
+    def test_post_detail_shows_latest_comments(self):
+        """Пост показывает последние комментарии, остальные подгружаются
+        по курсору."""
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}))
+        comments = response.context['comments']
+        self.assertEqual(len(comments), COMMENTS_ON_THE_FIRST_PAGE)
+        self.assertEqual(comments[-1].text,
+                         f'Комментарий {COMMENTS_COUNT - 1}')
+        self.assertTrue(comments.has_next())
+        response = self.client.get(
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk}),
+            {'cursor': comments.next_cursor})
+        self.assertTemplateUsed(response, 'includes/comments.html')
+        older = response.context['comments']
+        self.assertEqual([comment.text for comment in older],
+                         [f'Комментарий {i}' for i in
+                          range(COMMENTS_COUNT - COMMENTS_ON_THE_FIRST_PAGE)])
+        self.assertFalse(older.has_next())
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.cats = Post.objects.create(author=cls.user,
+                                       text='Котики спят на солнце')
+        cls.cat = Post.objects.create(author=cls.user,
+                                      text='Учёный КОТ и котики, котики')
+        cls.dogs = Post.objects.create(author=cls.user,
+                                       text='Собаки бегают')
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('posts:search'),
+                                   {'q': query, **params})
+        return list(response.context['page_obj'])
+
+    def test_search_finds_ranked_posts(self):
+        """Поиск без учёта регистра и ё, по префиксу, по рангу."""
+        self.assertEqual(self.search('котик'), [self.cat, self.cats])
+        self.assertEqual(self.search('кот'), [self.cat, self.cats])
+        self.assertEqual(self.search('ученый кот'), [self.cat])
+        self.assertEqual(self.search('"; DROP'), [])
+        self.assertEqual(self.search(''), [])
+
+    def test_admin_search_is_ranked(self):
+        """Поиск в админке тоже по рангу, а не по дате."""
+        Post.objects.filter(pk=self.cat.pk).update(
+            pub_date=self.cats.pub_date - timedelta(days=1))
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin')
+        self.client.force_login(admin)
+        url = reverse('admin:posts_post_changelist')
+        response = self.client.get(url, {'q': 'кот'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.cat, self.cats])
+        # Выбранная колонка (дата) важнее ранга.
+        response = self.client.get(url, {'q': 'кот', 'o': '-3'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.cats, self.cat])
+
+    def test_search_index_follows_changes(self):
+        """Правка и удаление поста сразу видны в поиске."""
+        self.dogs.text = 'Собаки и котики'
+        self.dogs.save()
+        self.assertIn(self.dogs, self.search('собаки котики'))
+        self.cat.delete()
+        self.assertCountEqual(self.search('кот'), [self.cats, self.dogs])
+
+    def test_search_paginator_keeps_query(self):
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'Котик №{i}')
+            for i in range(POSTS_ON_THE_FIRST_PAGE))
+        call_command('rebuild_search_index', stdout=StringIO())
+        response = self.client.get(reverse('posts:search'), {'q': 'котик'})
+        self.assertContains(response, '?q=%D0%BA%D0%BE%D1%82%D0%B8%D0%BA'
+                                      '&amp;page=2')
+        self.assertEqual(len(self.search('котик', page=2)), 2)
@@ -1,14 +1,25 @@
+import os
 import shutil
 import tempfile
+from io import BytesIO
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
 from django.test import Client, override_settings, TestCase
 from django.urls import reverse
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
 from http import HTTPStatus
+from PIL import Image
 
+from core import jobs
+from core.models import Job
+
+from ..images import VARIANTS_DIR, variant_formats
 from ..models import Comment, Group, Post
+from ..thumbnails import create_thumbnails, generation_lock, release_image
 
 User = get_user_model()
 NUMBER_OF_NEW_ENTRIES = 1
@@ -16,6 +27,14 @@ NUMBER_OF_GUEST_USER_POSTS = 0
 NUMBER_OF_NEW_COMMENTS = 1
 NUMBER_OF_NEW_GUEST_COMMENTS = 0
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
 
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
@@ -111,7 +130,225 @@ class PostFormTests(TestCase):
         post = response.context.get('post')
         self.assertEqual(response.status_code, HTTPStatus.OK)
         self.assertEqual(Post.objects.count(), NUMBER_OF_NEW_ENTRIES)
-        self.assertEqual(post.image, 'posts/small.gif')
+        # Имя файла — хеш содержимого.
+        self.assertRegex(post.image.name, r'^posts/[0-9a-f]{64}\.gif$')
+
+    @override_settings(THUMBNAIL_WORKERS=0)
+    def test_thumbnails_generated_on_upload(self):
+        """Варианты картинки создаются при сохранении поста,
+        до первого показа ленты, и выводятся в srcset"""
+        uploaded = SimpleUploadedFile(
+            name='thumb.gif',
+            content=SMALL_GIF,
+            content_type='image/gif'
+        )
+        self.authorized_client.post(reverse('posts:post_create'),
+                                    data={'text': 'Пост с картинкой',
+                                          'image': uploaded})
+        post = Post.objects.get()
+        # Картинка шириной 2 пикселя не увеличивается.
+        self.assertEqual(post.image_variant_widths, [2])
+        source = os.path.basename(post.image.name)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(TEMP_MEDIA_ROOT, VARIANTS_DIR))),
+            sorted(f'{source}_2w.{extension}'
+                   for extension, *_ in variant_formats()))
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, f'{source}_2w.jpg 2w')
+
+    def test_upload_is_stripped_and_downscaled(self):
+        """Загруженная картинка теряет EXIF и не превышает
+        IMAGE_MAX_SIZE"""
+        exif = Image.Exif()
+        exif[0x010F] = 'Камера'
+        buffer = BytesIO()
+        Image.new('RGB', (300, 100)).save(buffer, 'JPEG', exif=exif)
+        uploaded = SimpleUploadedFile(
+            name='photo.jpg',
+            content=buffer.getvalue(),
+            content_type='image/jpeg'
+        )
+        with override_settings(IMAGE_MAX_SIZE=150):
+            self.authorized_client.post(reverse('posts:post_create'),
+                                        data={'text': 'Фото',
+                                              'image': uploaded})
+        with Image.open(Post.objects.get().image.path) as image:
+            self.assertEqual(image.size, (150, 50))
+            self.assertNotIn('exif', image.info)
+
+    def test_image_metadata_filled_on_save(self):
+        """Размеры и заглушка картинки сохраняются вместе с постом и
+        выводятся в ленте без чтения файла"""
+        buffer = BytesIO()
+        Image.new('RGB', (300, 100), 'red').save(buffer, 'PNG')
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с картинкой', 'image': SimpleUploadedFile(
+                name='red.png', content=buffer.getvalue(),
+                content_type='image/png')})
+        post = Post.objects.get()
+        self.assertEqual((post.image_width, post.image_height), (300, 100))
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/png;base64,'))
+        self.assertLess(len(post.image_placeholder), 1000)
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, post.image_placeholder)
+        self.assertContains(response, 'loading="lazy"')
+        self.authorized_client.post(
+            reverse('posts:post_edit', args=[post.pk]),
+            data={'text': 'Без картинки', 'image-clear': 'on'})
+        post.refresh_from_db()
+        self.assertIsNone(post.image_width)
+        self.assertEqual(post.image_placeholder, '')
+
+    def test_variant_generated_on_first_request(self):
+        """Адреса вариантов выводятся до их создания, первый запрос
+        создаёт файл, чужие ширины не создаются"""
+        buffer = BytesIO()
+        Image.new('RGB', (300, 100), 'blue').save(buffer, 'PNG')
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с картинкой', 'image': SimpleUploadedFile(
+                name='blue.png', content=buffer.getvalue(),
+                content_type='image/png')})
+        post = Post.objects.get()
+        source = os.path.basename(post.image.name)
+        url = f'{settings.MEDIA_URL}{VARIANTS_DIR}{source}_300w.jpg'
+        path = os.path.join(TEMP_MEDIA_ROOT, VARIANTS_DIR,
+                            f'{source}_300w.jpg')
+        with generation_lock(post.image.name):
+            # Варианты создаёт кто-то другой: задача их не трогает.
+            create_thumbnails(post.image.name)
+        self.assertFalse(os.path.exists(path))
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, f'{url} 300w')
+        response = self.guest_client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('immutable', response['Cache-Control'])
+        # Создан только запрошенный файл, ширины отметит задача.
+        self.assertEqual(
+            [name for name in os.listdir(os.path.join(TEMP_MEDIA_ROOT,
+                                                      VARIANTS_DIR))
+             if name.startswith(source)],
+            [f'{source}_300w.jpg'])
+        post.refresh_from_db()
+        self.assertEqual(post.image_variant_widths, [])
+        # Задача дописывает недостающие варианты, не пересоздавая готовый.
+        modified = os.stat(path).st_mtime_ns
+        create_thumbnails(post.image.name)
+        self.assertEqual(os.stat(path).st_mtime_ns, modified)
+        post.refresh_from_db()
+        self.assertEqual(post.image_variant_widths, [300])
+        response = self.guest_client.get(
+            f'{settings.MEDIA_URL}{VARIANTS_DIR}{source}_640w.jpg')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_variants_of_same_stem_do_not_collide(self):
+        """У старых загрузок cat.jpg и cat.png свои варианты: создание,
+        удаление и выдача одного не задевают другой"""
+        posts_dir = os.path.join(TEMP_MEDIA_ROOT, 'posts')
+        os.makedirs(posts_dir, exist_ok=True)
+        posts = {}
+        for extension, color in (('jpg', 'red'), ('png', 'blue')):
+            name = f'posts/cat.{extension}'
+            self.addCleanup(Post.image.field.storage.delete, name)
+            Image.new('RGB', (300, 100), color).save(
+                os.path.join(TEMP_MEDIA_ROOT, name))
+            posts[extension] = Post.objects.create(
+                author=self.user, text=name, image=name, image_width=300,
+                image_height=100)
+        url = f'{settings.MEDIA_URL}{VARIANTS_DIR}cat.png_300w.jpg'
+        response = self.guest_client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        with Image.open(BytesIO(b''.join(response.streaming_content))) \
+                as image:
+            red, green, blue = image.convert('RGB').getpixel((150, 50))
+        self.assertGreater(blue, red)
+        create_thumbnails('posts/cat.jpg')
+        variants = os.path.join(TEMP_MEDIA_ROOT, VARIANTS_DIR)
+        self.assertTrue(os.path.exists(
+            os.path.join(variants, 'cat.png_300w.jpg')))
+        posts['jpg'].delete()
+        release_image('posts/cat.jpg', [300])
+        self.assertFalse(os.path.exists(
+            os.path.join(variants, 'cat.jpg_300w.jpg')))
+        self.assertTrue(os.path.exists(
+            os.path.join(variants, 'cat.png_300w.jpg')))
+
+    @override_settings(THUMBNAIL_WORKERS=0)
+    def test_same_image_stored_once(self):
+        """Одинаковые загрузки делят файл и варианты, файл удаляется
+        вместе с последним постом"""
+        posts_dir = os.path.join(TEMP_MEDIA_ROOT, 'posts')
+        os.makedirs(posts_dir, exist_ok=True)
+        files = set(os.listdir(posts_dir))
+        for name in ('first.gif', 'second.gif'):
+            self.authorized_client.post(
+                reverse('posts:post_create'),
+                data={'text': name, 'image': SimpleUploadedFile(
+                    name=name, content=SMALL_GIF, content_type='image/gif')})
+        first, second = Post.objects.order_by('pk')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(second.image_widths, first.image_widths)
+        # Файл мог остаться от другого теста с той же картинкой.
+        self.assertLessEqual(set(os.listdir(posts_dir)) - files,
+                             {os.path.basename(first.image.name), 'variants'})
+        path = first.image.path
+        variants = os.listdir(os.path.join(TEMP_MEDIA_ROOT, VARIANTS_DIR))
+        first.delete()
+        release_image(first.image.name, first.image_variant_widths)
+        self.assertTrue(os.path.exists(path))
+        second.delete()
+        release_image(second.image.name, second.image_variant_widths)
+        # Картинку только что загружали: удаление ждёт конца аренды.
+        self.assertTrue(os.path.exists(path))
+        cache.clear()
+        Job.objects.update(run_at=timezone.now())
+        jobs.run_pending()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(set(variants) & set(
+            os.listdir(os.path.join(TEMP_MEDIA_ROOT, VARIANTS_DIR))))
+
+    def test_release_keeps_file_saved_by_pending_upload(self):
+        """Удаление поста не стирает файл, который такая же загрузка
+        уже получила, но ещё не записала свой пост"""
+        storage = Post.image.field.storage
+        name = storage.save('posts/first.gif', ContentFile(SMALL_GIF))
+        first = Post.objects.create(author=self.user, text='first',
+                                    image=name)
+        cache.clear()
+        first.delete()
+        # Вторая загрузка сохранила файл, её пост ещё не подтверждён.
+        self.assertEqual(
+            storage.save('posts/second.gif', ContentFile(SMALL_GIF)), name)
+        release_image(name)
+        self.assertTrue(storage.exists(name))
+        Post.objects.create(author=self.user, text='second', image=name)
+        Job.objects.update(run_at=timezone.now())
+        cache.clear()
+        jobs.run_pending()
+        self.assertTrue(storage.exists(name))
+
+    def test_thumbnails_deferred_to_job_queue(self):
+        """По умолчанию миниатюры создаёт фоновая задача, а не запрос"""
+        thumbnails_dir = os.path.join(TEMP_MEDIA_ROOT, VARIANTS_DIR)
+        shutil.rmtree(thumbnails_dir, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, thumbnails_dir, ignore_errors=True)
+        uploaded = SimpleUploadedFile(
+            name='deferred.gif',
+            content=SMALL_GIF,
+            content_type='image/gif'
+        )
+        self.authorized_client.post(reverse('posts:post_create'),
+                                    data={'text': 'Пост с картинкой',
+                                          'image': uploaded})
+        job = Job.objects.get()
+        self.assertEqual(job.name, 'posts.thumbnails.create_thumbnails')
+        self.assertFalse(os.path.exists(thumbnails_dir))
+        jobs.run_pending()
+        self.assertFalse(Job.objects.exists())
+        self.assertTrue(os.listdir(thumbnails_dir))
+        self.assertEqual(Post.objects.get().image_widths, '2')
 
     def test_new_comment(self):
         """Проверка создания нового комментария в БД"""
@@ -0,0 +1,185 @@
+"""Заблаговременная генерация вариантов картинок постов.
+
+После загрузки картинки фоновая задача core.jobs создаёт её варианты
+(posts/images.py) и записывает их ширины в Post.image_widths. Пока
+вариантов нет, тег post_image при THUMBNAIL_ON_DEMAND всё равно выводит
+их адреса: они зависят только от имени картинки и Post.image_width.
+Первый запрос несуществующего варианта попадает в posts.views.image_variant,
+который создаёт этот вариант под блокировкой в кэше (ensure_variant), а
+дальше файл отдаёт веб-сервер. Посты без image_width по-прежнему
+получают кадр sorl FALLBACK_GEOMETRY.
+
+Картинки хранятся по хешу содержимого (core/storage.py): повторная
+загрузка той же картинки получает то же имя и готовые варианты другого
+поста, а файлы удаляются вместе с последним ссылающимся на них постом.
+"""
+import hashlib
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from sorl import thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.images import ImageFile
+
+from core import jobs, metrics
+from core.storage import is_leased, name_lock
+
+from . import feed_cache, images
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_GEOMETRY = ('960x339', {'crop': 'center', 'upscale': True})
+LOCK_POLL_INTERVAL = 0.1
+
+
+class TimedThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl, замеряющий время создания миниатюры.
+
+    Попадания в KV-хранилище не считаются: замеряется только генерация.
+    """
+
+    def _create_thumbnail(self, source_image, geometry_string, options,
+                          thumbnail):
+        with metrics.timer('yatube_thumbnail_seconds',
+                           geometry=geometry_string):
+            super()._create_thumbnail(source_image, geometry_string,
+                                      options, thumbnail)
+
+
+@contextmanager
+def generation_lock(image_name):
+    """Блокировка на создание вариантов картинки, общая для процессов.
+
+    Отдаёт True, если блокировка взята, и False, если варианты уже
+    создаёт кто-то другой.
+    """
+    digest = hashlib.md5(image_name.encode()).hexdigest()
+    key = f'thumbnail-lock:{digest}'
+    acquired = cache.add(key, True, settings.THUMBNAIL_LOCK_TIMEOUT)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            cache.delete(key)
+
+
+def create_thumbnails(image_name):
+    """Задача очереди: создаёт варианты картинки и отмечает их у постов."""
+    with generation_lock(image_name) as acquired:
+        # Иначе их уже создаёт запрос к image_variant или другая задача.
+        if acquired:
+            _create_variants(image_name)
+
+
+def ensure_variant(image_name, width, extension):
+    """Создаёт вариант картинки, если его файла ещё нет.
+
+    Создаётся только этот файл: остальные варианты уже может отдавать
+    веб-сервер, а адреса вариантов от их создания не меняются, так что
+    поколения лент не трогаются. Создаёт его один процесс, остальные
+    ждут файл не дольше THUMBNAIL_LOCK_TIMEOUT секунд.
+    """
+    name = images.variant_name(image_name, width, extension)
+    deadline = time.monotonic() + settings.THUMBNAIL_LOCK_TIMEOUT
+    while not default_storage.exists(name):
+        with generation_lock(image_name) as acquired:
+            if acquired:
+                images.save_variant(image_name, width, extension)
+                return
+        if time.monotonic() > deadline:
+            return
+        time.sleep(LOCK_POLL_INTERVAL)
+
+
+def _create_variants(image_name):
+    if not Post.objects.filter(image=image_name).exists():
+        # Пост удалили, пока задача ждала очереди.
+        return
+    widths = images.save_variants(image_name)
+    Post.objects.filter(image=image_name).update(
+        image_widths=','.join(map(str, widths)))
+    # Посты, загруженные до появления размеров и заглушки.
+    missing = Post.objects.filter(image=image_name, image_width=None)
+    if missing.exists():
+        with Post.image.field.storage.open(image_name) as file:
+            missing.update(**images.image_metadata(file))
+    # Фрагменты лент и страницы с запасным кадром sorl больше не нужны.
+    feed_cache.bump_generation(feed_cache.POSTS_SCOPE)
+    for post in Post.objects.filter(image=image_name).only(
+            'author', 'group'):
+        for scope in feed_cache.post_scopes(post):
+            feed_cache.bump_generation(scope)
+
+
+def generate_thumbnails(image_name):
+    """Создаёт варианты картинки, ошибки только в лог."""
+    try:
+        create_thumbnails(image_name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', image_name)
+
+
+def generate_in_worker(image_name):
+    try:
+        generate_thumbnails(image_name)
+    finally:
+        # У рабочего потока своё соединение с БД и свой буфер метрик.
+        connection.close()
+        metrics.flush()
+
+
+def schedule_thumbnails(post):
+    """Ставит создание вариантов картинки поста в очередь задач.
+
+    Если та же картинка уже есть у другого поста, берёт его варианты.
+    """
+    widths = ''
+    if post.image:
+        widths = (Post.objects.filter(image=post.image.name)
+                  .exclude(pk=post.pk).exclude(image_widths='')
+                  .values_list('image_widths', flat=True).first() or '')
+    if widths != post.image_widths:
+        # Ширины прежней картинки после правки поста уже не подходят.
+        post.image_widths = widths
+        Post.objects.filter(pk=post.pk).update(image_widths=widths)
+    if not post.image:
+        return
+    if widths:
+        for scope in (feed_cache.POSTS_SCOPE,
+                      *feed_cache.post_scopes(post)):
+            feed_cache.bump_generation(scope)
+    elif settings.THUMBNAIL_WORKERS:
+        jobs.defer(create_thumbnails, post.image.name)
+    else:
+        generate_thumbnails(post.image.name)
+
+
+def release_image(image_name, widths=()):
+    """Удаляет картинку, её варианты шириной widths и миниатюры, если
+    на неё больше не ссылается ни один пост."""
+    # Удаляются только файлы, которые хранилище само положило в upload_to.
+    field = Post.image.field
+    if not image_name or not image_name.startswith(field.upload_to):
+        return
+    with name_lock(image_name):
+        if Post.objects.filter(image=image_name).exists():
+            return
+        if is_leased(image_name):
+            # Такую же картинку только что загрузили, и пост с ней может
+            # быть ещё не подтверждён: проверим после конца аренды.
+            jobs.defer(release_image, image_name, list(widths),
+                       delay=settings.STORAGE_LEASE_TIMEOUT)
+            return
+        images.delete_variants(image_name, widths)
+        # Ключ sorl включает хранилище, поэтому картинка передаётся с ним.
+        thumbnail.delete(ImageFile(image_name, field.storage))
+
+
+def release_on_commit(image_name, widths=()):
+    transaction.on_commit(lambda: release_image(image_name, widths))
@@ -0,0 +1,204 @@
+"""Материализованная лента подписок (fan-out on write).
+
+Новый пост раскладывается в TimelineEntry каждого подписчика, поэтому
+follow_index читает ленту одним диапазоном по индексу (user, pub_date, post).
+Посты авторов с огромным числом подписчиков не раскладываются и ничего
+не пишут при чтении: MergedFeed сливает ленту читателя с постами таких
+авторов в момент запроса, читая из каждого потока не больше страницы.
+Обрезка лент подписчиков до TIMELINE_SIZE — фоновая задача, чтобы время
+публикации не росло с числом подписчиков.
+"""
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+
+from core import jobs
+
+from .follow_graph import get_following_ids
+from .models import Follow, Post, TimelineEntry, UserCounters
+
+CELEBRITIES_CACHE_KEY = 'posts:timeline:celebrities'
+FEED_ORDERING = ('-pub_date', '-post_id')
+# Строки дальше TIMELINE_SIZE в лентах выбранных пользователей.
+TRIM_SQL = '''
+DELETE FROM {table} WHERE id IN (
+    SELECT id FROM (
+        SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY user_id ORDER BY pub_date DESC, post_id DESC
+        ) AS position
+        FROM {table} WHERE user_id IN ({users})
+    ) AS ranked WHERE position > %s
+)
+'''
+TRIM_CHUNK_SIZE = 500
+
+
+def get_celebrity_ids():
+    """Авторы, чьи посты подмешиваются в ленту при чтении."""
+    def load():
+        return frozenset(
+            UserCounters.objects
+            .filter(followers_count__gt=settings.TIMELINE_FANOUT_LIMIT)
+            .values_list('user_id', flat=True)
+        )
+    return cache.get_or_set(CELEBRITIES_CACHE_KEY, load,
+                            settings.TIMELINE_CELEBRITIES_TTL)
+
+
+def trim_timelines(user_ids):
+    """Обрезает ленты user_ids до TIMELINE_SIZE одним запросом на пачку."""
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), TRIM_CHUNK_SIZE):
+        chunk = user_ids[start:start + TRIM_CHUNK_SIZE]
+        sql = TRIM_SQL.format(table=TimelineEntry._meta.db_table,
+                              users=', '.join(['%s'] * len(chunk)))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*chunk, settings.TIMELINE_SIZE])
+
+
+def fan_out_post(post):
+    if post.author_id in get_celebrity_ids():
+        return
+    follower_ids = list(Follow.objects.filter(author_id=post.author_id)
+                        .values_list('user_id', flat=True))
+    if not follower_ids:
+        return
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+         for user_id in follower_ids),
+        ignore_conflicts=True
+    )
+    jobs.defer(trim_timelines, follower_ids)
+
+
+def _copy_posts(user_id, posts):
+    posts = posts.order_by('-pub_date').values_list('pk', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+         for post_id, pub_date in posts[:settings.TIMELINE_SIZE]),
+        ignore_conflicts=True
+    )
+    trim_timelines([user_id])
+
+
+def backfill_author(user_id, author_id):
+    if author_id in get_celebrity_ids():
+        # Его посты подмешивает MergedFeed.
+        return
+    _copy_posts(user_id, Post.objects.filter(author_id=author_id))
+
+
+def remove_author(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 post__author_id=author_id).delete()
+
+
+def rebuild_timeline(user_id):
+    TimelineEntry.objects.filter(user_id=user_id).delete()
+    author_ids = (Follow.objects.filter(user_id=user_id)
+                  .values_list('author_id', flat=True))
+    for author_id in author_ids:
+        backfill_author(user_id, author_id)
+
+
+def _post_stream_names(names):
+    # Пути TimelineEntry вида post__text в пути Post.
+    return [name[len('post__'):] for name in names
+            if name and name.startswith('post__')]
+
+
+class MergedFeed:
+    """Записи ленты и посты авторов без fan-out одним потоком.
+
+    Ведёт себя как QuerySet записей TimelineEntry в том объёме, в каком
+    его используют Paginator, CursorPaginator и api.project(): фильтр и
+    сортировка применяются к каждому потоку, из каждого читается не
+    больше среза, а посты без записи заворачиваются в несохранённые
+    TimelineEntry.
+    """
+    model = TimelineEntry
+    ordered = True
+
+    def __init__(self, user_id, entries, posts, ordering=FEED_ORDERING):
+        self.user_id = user_id
+        self.entries = entries
+        self.posts = posts
+        self.ordering = tuple(ordering)
+
+    def _apply(self, method, entry_args, post_args):
+        return MergedFeed(
+            self.user_id, getattr(self.entries, method)(*entry_args),
+            [getattr(posts, method)(*post_args) for posts in self.posts],
+            self.ordering)
+
+    def filter(self, *args):
+        # У Post есть аннотация post_id, так что условия курсора общие.
+        return self._apply('filter', args, args)
+
+    def order_by(self, *names):
+        feed = self._apply('order_by', names, names)
+        feed.ordering = names
+        return feed
+
+    def select_related(self, *names):
+        if names == (None,):
+            return self._apply('select_related', names, names)
+        return self._apply('select_related', names,
+                           _post_stream_names(names))
+
+    def only(self, *names):
+        return self._apply('only', names,
+                           ['pub_date', *_post_stream_names(names)])
+
+    def count(self):
+        return self.entries.count() + sum(posts.count()
+                                          for posts in self.posts)
+
+    def _wrap(self, posts):
+        for post in posts:
+            yield TimelineEntry(user_id=self.user_id, post=post,
+                                pub_date=post.pub_date)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        streams = [self.entries[:stop]]
+        streams.extend(self._wrap(posts[:stop]) for posts in self.posts)
+        merged = heapq.merge(
+            *streams, key=lambda entry: (entry.pub_date, entry.post_id),
+            reverse=self.ordering[0].startswith('-'))
+        return list(islice(merged, start, stop))
+
+    def __iter__(self):
+        return iter(self[:None])
+
+
+def get_feed(user):
+    """Записи ленты подписок user, от новых к старым.
+
+    Пагинируются сами TimelineEntry, пост каждой записи уже подтянут
+    через select_related. Если user подписан на авторов без fan-out,
+    их посты подмешиваются при чтении, без записи в базу.
+    """
+    entries = (TimelineEntry.objects.filter(user=user)
+               .select_related('post__author', 'post__group')
+               .order_by(*FEED_ORDERING))
+    author_ids = get_following_ids(user.pk) & get_celebrity_ids()
+    if not author_ids:
+        return entries
+    # Записи о постах этих авторов могли остаться с тех пор, когда
+    # fan-out для них ещё делался: их пост придёт из своего потока.
+    entries = entries.exclude(post__author_id__in=author_ids)
+    # По потоку на автора: каждый идёт по индексу (author, pub_date)
+    # без сортировки во временном B-дереве.
+    posts = [Post.objects.filter(author_id=author_id)
+             .annotate(post_id=F('pk'))
+             .select_related('author', 'group')
+             .order_by(*FEED_ORDERING)
+             for author_id in sorted(author_ids)]
+    return MergedFeed(user.pk, entries, posts)
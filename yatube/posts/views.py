@@ -1,33 +1,87 @@
+from django.conf import settings
 from django.core.paginator import Paginator
 from django.shortcuts import render, get_object_or_404
 from django.shortcuts import redirect
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
 
-from .models import Follow, Group, Post, User
+from .models import Comment, Follow, Group, Post, User, prepare_posts
 from .forms import CommentForm, PostForm
+from .images import (VARIANTS_DIR, parse_variant_name, variant_formats,
+                     variant_name, variant_widths)
+from .conditional import (conditional_page, latest_in_group,
+                          latest_in_post, latest_in_profile)
+from .feed_cache import get_feed_generation
+from .follow_graph import following_states
+from .search import search_posts
+from .paginators import CountedPaginator, CursorPaginator, CURSOR_ORDERING
+from .thumbnails import (ensure_variant, release_on_commit,
+                         schedule_thumbnails)
+from .timeline import FEED_ORDERING, get_feed
 
 POSTS_PAGE = 10
 PAGINATOR_NUMBER = 10
-
-
-def get_page_paginator(queryset, request):
-    paginator = Paginator(queryset, PAGINATOR_NUMBER)
+COMMENTS_PAGE = 20
+COMMENTS_ORDERING = ('-created', '-pk')
+# Имя варианта однозначно задаёт его содержимое.
+VARIANT_CACHE_SECONDS = 60 * 60 * 24 * 365
+
+
+def get_page_paginator(queryset, request, count=None,
+                       ordering=CURSOR_ORDERING):
+    if 'cursor' in request.GET or settings.POSTS_PAGINATION == 'cursor':
+        paginator = CursorPaginator(queryset, PAGINATOR_NUMBER, ordering)
+        return paginator.get_page(request.GET.get('cursor'))
+    if count is not None:
+        paginator = CountedPaginator(queryset, PAGINATOR_NUMBER, count)
+    else:
+        paginator = Paginator(queryset, PAGINATOR_NUMBER)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     return page_obj
 
 
+def get_comments_page(post_id, cursor=None):
+    """Последние COMMENTS_PAGE комментариев до курсора, старые сверху."""
+    comments = Comment.objects.filter(
+        post_id=post_id).select_related('author')
+    paginator = CursorPaginator(comments, COMMENTS_PAGE, COMMENTS_ORDERING)
+    page = paginator.get_page(cursor)
+    page.object_list.reverse()
+    return page
+
+
 def index(request):
-    posts = Post.objects.select_related('author', 'group')
+    posts = Post.objects.select_related('author', 'group').for_display()
     page_obj = get_page_paginator(posts, request)
-    return render(request, 'posts/index.html', {'page_obj': page_obj,
-                                                'index': True})
+    context = {
+        'page_obj': page_obj,
+        'index': True,
+        'feed_generation': get_feed_generation(),
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT
+    }
+    return render(request, 'posts/index.html', context)
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    posts = (search_posts(query).select_related('author', 'group')
+             .for_display())
+    # Курсор не годится: порядок задаёт ранг, а не поля модели.
+    paginator = Paginator(posts, PAGINATOR_NUMBER)
+    context = {
+        'query': query,
+        'page_obj': paginator.get_page(request.GET.get('page'))
+    }
+    return render(request, 'posts/search.html', context)
 
 
+@conditional_page(latest_in_group)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.select_related('author', 'group')
+    posts = group.posts.select_related('author', 'group').for_display()
     title = f'Записи сообщества {group}'
     page_obj = get_page_paginator(posts, request)
     context = {
@@ -38,12 +92,15 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional_page(latest_in_profile)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.select_related('author', 'group')
-    following = (request.user.is_authenticated
-                 and author.following.filter(user=request.user).exists())
-    page_obj = get_page_paginator(posts, request)
+    author = get_object_or_404(User.objects.select_related('counters'),
+                               username=username)
+    posts = author.posts.select_related('author', 'group').for_display()
+    following = following_states(request.user, [author.pk])[author.pk]
+    counters = getattr(author, 'counters', None)
+    page_obj = get_page_paginator(
+        posts, request, counters and counters.posts_count)
     context = {
         'author': author,
         'page_obj': page_obj,
@@ -52,9 +109,11 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+@conditional_page(latest_in_post)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    comments = post.comments.select_related('author')
+    post = get_object_or_404(
+        Post.objects.select_related('author__counters', 'group'), pk=post_id)
+    comments = get_comments_page(post.pk)
     form = CommentForm()
     context = {
         'post': post,
@@ -64,6 +123,16 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+def post_comments(request, post_id):
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    comments = get_comments_page(post.pk, request.GET.get('cursor'))
+    context = {
+        'post': post,
+        'comments': comments
+    }
+    return render(request, 'includes/comments.html', context)
+
+
 @login_required
 def post_create(request):
     form = PostForm(request.POST or None,
@@ -72,6 +141,7 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        schedule_thumbnails(post)
         return redirect('posts:profile', request.user)
     return render(request, 'posts/create_post.html', {'form': form,
                                                       'is_edit': False})
@@ -80,6 +150,7 @@ def post_create(request):
 @login_required
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
+    old_image, old_widths = post.image.name, post.image_variant_widths
     form = PostForm(request.POST or None,
                     files=request.FILES or None,
                     instance=post)
@@ -87,6 +158,10 @@ def post_edit(request, post_id):
         return redirect('posts:post_detail', post_id=post.pk)
     if request.method == 'POST' and form.is_valid():
         form.save()
+        if 'image' in form.changed_data:
+            schedule_thumbnails(post)
+            if old_image != post.image.name:
+                release_on_commit(old_image, old_widths)
         return redirect('posts:post_detail', post_id=post.pk)
     return render(request, 'posts/create_post.html', {'form': form,
                                                       'is_edit': True,
@@ -107,11 +182,15 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = get_page_paginator(post_list, request)
+    entries = get_feed(request.user)
+    page_obj = get_page_paginator(entries, request, ordering=FEED_ORDERING)
+    page_obj.object_list = prepare_posts(
+        [entry.post for entry in page_obj.object_list])
     context = {
         'page_obj': page_obj,
-        'follow': True
+        'follow': True,
+        'feed_generation': get_feed_generation(request.user),
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT
     }
     return render(request, 'posts/follow.html', context)
 
@@ -131,3 +210,31 @@ def profile_unfollow(request, username):
     user = request.user
     get_object_or_404(Follow, user=user, author__username=username).delete()
     return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
+
+
+def image_variant(request, name):
+    """Отдаёт вариант картинки поста, при первом запросе создаёт его.
+
+    Дальше файл лежит в MEDIA_ROOT, и его отдаёт веб-сервер.
+    """
+    parsed = parse_variant_name(name)
+    if parsed is None:
+        raise Http404
+    source, width, extension = parsed
+    image_name = Post.image.field.upload_to + source
+    path = VARIANTS_DIR + name
+    # Создаются только варианты, которые мог вывести тег post_image.
+    image_width = (Post.objects.filter(image=image_name)
+                   .exclude(image_width=None)
+                   .values_list('image_width', flat=True).first())
+    extensions = {variant[0] for variant in variant_formats()}
+    if (image_width is None
+            or variant_name(image_name, width, extension) != path
+            or width not in variant_widths(image_width)
+            or extension not in extensions):
+        raise Http404
+    ensure_variant(image_name, width, extension)
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    patch_cache_control(response, public=True,
+                        max_age=VARIANT_CACHE_SECONDS, immutable=True)
+    return response
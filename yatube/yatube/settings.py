@@ -39,7 +39,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.QueryInstrumentationMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -52,12 +55,19 @@ MIDDLEWARE = [
 ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.template_backend.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Без DEBUG скомпилированные шаблоны живут в памяти процесса.
+            'loaders': (TEMPLATE_LOADERS if DEBUG else [
+                ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+            ]),
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -68,6 +78,9 @@ TEMPLATES = [
         },
     },
 ]
+# Шаблоны приложений читает app_directories.Loader из 'loaders', хотя
+# APP_DIRS не задан: проверка debug_toolbar этого не видит.
+SILENCED_SYSTEM_CHECKS = ['debug_toolbar.W006']
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
@@ -75,13 +88,56 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# core.sqlite: WAL и PRAGMA на каждом соединении, BEGIN IMMEDIATE и повтор
+# запросов при «database is locked». Соединение живёт между запросами.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'core.sqlite',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 20,
+            'pragmas': {'busy_timeout': 20000},
+        },
+    },
+    # Копия основной базы, её обновляет manage.py sync_replica.
+    'replica': {
+        'ENGINE': 'core.sqlite',
+        'NAME': os.path.join(BASE_DIR, 'db.replica.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 20,
+            'pragmas': {'busy_timeout': 20000},
+        },
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+DATABASE_ROUTERS = ['core.replica.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+# Страницы, которые читают с реплики.
+REPLICA_VIEWS = {
+    'posts:index',
+    'posts:group_list',
+    'posts:profile',
+    'posts:post_detail',
+    'posts:follow_index',
+}
+# После записи в этих представлениях браузер читает из основной базы.
+REPLICA_PIN_VIEWS = {
+    'posts:post_create',
+    'posts:post_edit',
+    'posts:add_comment',
+    'posts:profile_follow',
+    'posts:profile_unfollow',
+    'users:signup',
+    'users:login',
+    'users:password_change',
+    'users:password_reset_confirm',
+}
+REPLICA_PIN_SECONDS = 30
+REPLICA_SYNC_INTERVAL = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -126,7 +182,10 @@ LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
 # LOGOUT_REDIRECT_URL = 'posts:index'
 
-EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+# Письма отправляет фоновая задача (core/mail.py) через
+# QUEUED_EMAIL_BACKEND.
+EMAIL_BACKEND = 'core.mail.QueuedEmailBackend'
+QUEUED_EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
@@ -134,12 +193,104 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Двухуровневый кэш (core/cache.py): LRU в памяти каждого процесса поверх
+# общего для всех процессов SQLite-файла с журналом инвалидаций.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache.TwoTierCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 60,
+            'SYNC_INTERVAL': 0.1,
+            'METRICS_NAME': 'default',
+        },
+    },
+    # {% cache %} читает этот псевдоним: тот же файл, но свои метрики.
+    'template_fragments': {
+        'BACKEND': 'core.cache.TwoTierCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 60,
+            'SYNC_INTERVAL': 0.1,
+            'METRICS_NAME': 'template_fragments',
+        },
+    },
 }
 
+# 'page' — классическая пагинация ?page=N, 'cursor' — keyset по (pub_date, id)
+# без COUNT и OFFSET; ?cursor= в запросе включает её для отдельной ссылки.
+POSTS_PAGINATION = 'page'
+
+# Лента подписок: сколько записей хранить на пользователя и с какого числа
+# подписчиков посты автора не раскладываются, а подмешиваются при чтении.
+TIMELINE_SIZE = 500
+TIMELINE_FANOUT_LIMIT = 1000
+TIMELINE_CELEBRITIES_TTL = 60 * 10
+
+# Фрагменты лент инвалидируются поколениями (posts/feed_cache.py),
+# поэтому TTL может быть долгим.
+FEED_CACHE_TIMEOUT = 60 * 60 * 6
+# Подписки пользователя (posts/follow_graph.py) тоже ключуются поколением.
+FOLLOWING_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Миниатюры новой картинки создаёт фоновая задача (posts/thumbnails.py);
+# 0 — создавать сразу в запросе. Это же число потоков по умолчанию
+# у manage.py generate_thumbnails.
+THUMBNAIL_WORKERS = 2
+# Загруженная картинка уменьшается до IMAGE_MAX_SIZE по большей стороне,
+# варианты для srcset создаются в этих ширинах (posts/images.py).
+IMAGE_MAX_SIZE = 2048
+IMAGE_VARIANT_WIDTHS = (320, 480, 640, 960)
+# Адреса вариантов считаются без обращения к файлам и KV sorl; вариант,
+# которого ещё нет, создаёт view image_variant. Веб-серверу достаточно
+# отдавать MEDIA_ROOT, а при отсутствии файла передавать запрос Django
+# (nginx: try_files $uri @django). Параллельные запросы ждут создания
+# вариантов не дольше THUMBNAIL_LOCK_TIMEOUT секунд.
+THUMBNAIL_ON_DEMAND = True
+THUMBNAIL_LOCK_TIMEOUT = 30
+# Файл, только что сохранённый в ContentAddressedStorage, не удаляется
+# STORAGE_LEASE_TIMEOUT секунд: за это время запись, которая на него
+# ссылается, успевает подтвердиться. Блокировка имени между сохранением
+# и удалением истекает через STORAGE_LOCK_TIMEOUT секунд.
+STORAGE_LEASE_TIMEOUT = 60
+STORAGE_LOCK_TIMEOUT = 10
+
+# Очередь фоновых задач (core/jobs.py) и manage.py worker: потоков,
+# попыток до статуса dead, начальная пауза перед повтором в секундах
+# (удваивается), через сколько секунд задачу упавшего воркера можно
+# взять снова и как часто простаивающий воркер проверяет очередь.
+JOBS_WORKERS = 4
+JOBS_MAX_ATTEMPTS = 5
+JOBS_BACKOFF = 10
+JOBS_LOCK_TIMEOUT = 60 * 10
+JOBS_POLL_INTERVAL = 1
+# Без отдельного manage.py worker задачи выполняются в самом процессе
+# после подтверждения транзакции (отложенные — при следующей задаче).
+JOBS_ALWAYS_EAGER = DEBUG
+
+# Бюджеты SQL на HTTP-запрос (core/middleware.py): сверх них в лог core.sql
+# пишется предупреждение. SQL_REPEAT_THRESHOLD запросов одной формы
+# считаются N+1; SQL_VIEW_BUDGETS задаёт число запросов для отдельных view.
+SQL_QUERY_BUDGET = 20
+SQL_TIME_BUDGET_MS = 200
+SQL_REPEAT_THRESHOLD = 5
+SQL_VIEW_BUDGETS = {}
+
+# Метрики Prometheus на /metrics/ (core/metrics.py): потоки копят их в памяти
+# и раз в METRICS_FLUSH_INTERVAL секунд сбрасывают в общий для процессов файл.
+METRICS_PATH = os.path.join(BASE_DIR, 'metrics.sqlite3')
+
+# Тесты держат кэш и метрики во временном каталоге (для pytest то же
+# делает conftest.py в корне репозитория).
+TEST_RUNNER = 'core.testing.TestRunner'
+METRICS_FLUSH_INTERVAL = 1
+
+THUMBNAIL_BACKEND = 'posts.thumbnails.TimedThumbnailBackend'
+
 INTERNAL_IPS = [
     '127.0.0.1',
 ]
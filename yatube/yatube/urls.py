@@ -3,6 +3,10 @@ from django.urls import include, path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core.views import metrics_view
+from posts.images import VARIANTS_DIR
+from posts.views import image_variant
+
 
 handler404 = 'core.views.page_not_found'
 handler500 = 'core.views.server_error'
@@ -15,6 +19,10 @@ urlpatterns = [
     path('auth/', include('django.contrib.auth.urls')),
     path('about/', include('about.urls', namespace='about')),
     path('admin/', admin.site.urls),
+    path('metrics/', metrics_view, name='metrics'),
+    # Только первый запрос варианта: потом файл отдаёт веб-сервер.
+    path(settings.MEDIA_URL.lstrip('/') + VARIANTS_DIR + '<str:name>',
+         image_variant, name='image_variant'),
 ]
 
 if settings.DEBUG: